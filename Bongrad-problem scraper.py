@@ -1,14 +1,17 @@
 import requests
-from bs4 import BeautifulSoup
 import time
 import random
 import os
+import sys
 import csv
+import json
 from urllib.parse import urljoin
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from threading import Lock
+from instrumentation import span, incr
+from page_archive import PageArchive, ARCHIVE_NAME, HTML_PARSER, parse_problem, parse_archive_chunk
 
 # ==========================================================
 # 1. 参数设置
@@ -23,6 +26,7 @@ SOLUTION_FILE = os.path.join(OUTPUT_DIR, "solutions_and_images.csv")
 REPORT_FILE = os.path.join(OUTPUT_DIR, "patterns_report.txt") # 新增报告文件
 
 MAX_WORKERS = 7
+METADATA_FILE = "page_metadata.json"   # 离线重新解析归档的输出
 success_count = 0
 count_lock = Lock()
 report_lock = Lock()
@@ -38,8 +42,21 @@ session.mount("https://", adapter)
 session.mount("http://", adapter)
 session.headers.update(HEADERS)
 
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+# ==========================================================
+# 3. 网页归档 + 解析 (抓到的 HTML 都存下来，改解析逻辑不用重新爬)
+# ==========================================================
+_archive = None
+_archive_lock = Lock()
+
+def get_archive():
+    """
+    归档文件放在 OUTPUT_DIR 下 (OUTPUT_DIR 可能在 import 之后被改掉，所以第一次用到时才打开)
+    """
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = PageArchive(os.path.join(OUTPUT_DIR, ARCHIVE_NAME))
+    return _archive
 
 # ==========================================================
 # 4. 下载逻辑 (保持你的原版，支持任意数量)
@@ -51,12 +68,16 @@ def download_image(img_url, filename, bp_id):
     if os.path.exists(image_path):
         return os.path.join(f"BP{bp_id}", filename)
     try:
-        r = session.get(img_url, timeout=10)
+        with span("http_fetch", kind="image"):
+            r = session.get(img_url, timeout=10)
         if r.status_code == 200:
             with open(image_path, "wb") as f:
                 f.write(r.content)
+            incr("images_downloaded")
+            incr("image_bytes_downloaded", len(r.content))
             return os.path.join(f"BP{bp_id}", filename)
     except: pass
+    incr("images_download_failed")
     return "download_failed"
 
 # ==========================================================
@@ -67,13 +88,17 @@ def fetch_problem(bp_id):
     url = f"{BASE_URL}{bp_id}"
 
     try:
-        r = session.get(url, timeout=10)
-        if r.status_code != 200: return None
-        soup = BeautifulSoup(r.text, "html.parser")
-
-        # 只要是 examples 目录下的图都抓
-        img_tags = soup.find_all("img", src=lambda src: src and "/examples/" in src)
-        img_count = len(img_tags)
+        with span("http_fetch", kind="page"):
+            r = session.get(url, timeout=10)
+        if r.status_code != 200:
+            incr("pages_missing")
+            return None
+        get_archive().append(f"BP{bp_id}", r.content, url=url, status=r.status_code, encoding=r.encoding)
+        incr("pages_archived")
+        with span("html_parse"):
+            # 只要是 examples 目录下的图都抓
+            img_srcs, solution_text = parse_problem(r.text, bp_id)
+        img_count = len(img_srcs)
 
         # 满足最少 12 张的要求
         if img_count < 12: return None
@@ -84,22 +109,15 @@ def fetch_problem(bp_id):
                 with open(REPORT_FILE, "a", encoding="utf-8") as rf:
                     rf.write(f"ID: BP{bp_id} | Total Images: {img_count}\n")
 
-        # 提取 solution 逻辑保持不变
-        solution_text = "No solution found"
-        link = soup.find("a", href=f"/BP{bp_id}", string=f"BP{bp_id}")
-        if link and link.find_parent("tr"):
-            tds = link.find_parent("tr").find_all("td")
-            if len(tds) >= 3: solution_text = tds[2].get_text(strip=True)
-
         # 下载所有抓到的图片
         image_paths = []
-        for img in img_tags:
-            src = img["src"]
+        for src in img_srcs:
             img_url = urljoin("https://oebp.org", src)
             filename = os.path.basename(src)
             path = download_image(img_url, filename, bp_id)
             image_paths.append(path)
 
+        incr("problems_fetched")
         print(f"✅ BP{bp_id} success (Found {img_count} images)")
 
         return {
@@ -109,13 +127,20 @@ def fetch_problem(bp_id):
         }
 
     except Exception as e:
+        incr("problems_failed")
         print(f"❌ BP{bp_id} error {e}")
         return None
 
 # ==========================================================
 # 7. 主程序
 # ==========================================================
-if __name__ == "__main__":
+def crawl(start_id=START_ID, end_id=END_ID, target_count=TARGET_COUNT):
+    """
+    抓取 start_id..end_id，收集满 target_count 道题为止
+    输出目录在这里才创建 (import 本文件不会在磁盘上建任何东西)
+    """
+    global success_count
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     # 初始化报告文件
     with open(REPORT_FILE, "w", encoding="utf-8") as rf:
         rf.write("--- Bongard Problems with > 12 Images ---\n")
@@ -130,12 +155,12 @@ if __name__ == "__main__":
         writer.writeheader()
 
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = {executor.submit(fetch_problem, i): i for i in range(START_ID, END_ID+1)}
+            futures = {executor.submit(fetch_problem, i): i for i in range(start_id, end_id+1)}
             for future in as_completed(futures):
                 result = future.result()
                 if result:
                     with count_lock:
-                        if success_count >= TARGET_COUNT: break
+                        if success_count >= target_count: break
                         success_count += 1
                         current = success_count
 
@@ -146,6 +171,40 @@ if __name__ == "__main__":
                     
                     writer.writerow(row)
                     f.flush()
-                    print(f"📊 Collected {current}/{TARGET_COUNT}")
+                    print(f"📊 Collected {current}/{target_count}")
 
-    print(f"\n🎉 Finished! Report saved in {REPORT_FILE}")
\ No newline at end of file
+    print(f"\n🎉 Finished! Report saved in {REPORT_FILE}")
+    return success_count
+
+# ==========================================================
+# 8. 离线重新解析：不联网，多进程跑一遍归档里的所有页面
+# ==========================================================
+def reparse_archive(output_json=METADATA_FILE, num_workers=None, chunk_size=64, archive_path=None):
+    archive = PageArchive(archive_path) if archive_path else get_archive()
+    entries = sorted(archive.index.values(), key=lambda e: e["offset"])
+    chunks = [(archive.path, entries[i:i + chunk_size]) for i in range(0, len(entries), chunk_size)]
+    print(f"🔁 离线重新解析 {len(entries)} 个页面 (解析器: {HTML_PARSER})...")
+
+    start = time.perf_counter()
+    metadata = {}
+    with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+        for part in executor.map(parse_archive_chunk, chunks):
+            metadata.update(part)
+    elapsed = time.perf_counter() - start
+
+    metadata = dict(sorted(metadata.items(), key=lambda kv: int(kv[0][2:]) if kv[0][2:].isdigit() else 0))
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2, ensure_ascii=False)
+
+    usable = sum(1 for m in metadata.values() if m["image_count"] >= 12)
+    print(f"✅ 解析完成: {len(metadata)} 页，{usable} 页有 >= 12 张例图，用时 {elapsed:.2f}s")
+    print(f"💾 结果已保存至: {output_json}")
+    return metadata
+
+if __name__ == "__main__":
+    # python "Bongrad-problem scraper.py"          -> 联网爬取 (页面同时存进归档)
+    # python "Bongrad-problem scraper.py" reparse [归档路径]  -> 不联网，重新解析归档里的所有页面
+    if len(sys.argv) > 1 and sys.argv[1] == "reparse":
+        reparse_archive(archive_path=sys.argv[2] if len(sys.argv) > 2 else None)
+    else:
+        crawl()
@@ -1,6 +1,7 @@
 import os
 import textwrap
 from PIL import Image, ImageDraw, ImageFont
+from instrumentation import span, incr
 
 # --- 布局常量 ---
 SUB_GRID_ROWS = 3
@@ -74,9 +75,12 @@ def process_and_move(bp_id):
 
         try:
             with Image.open(img_path) as img:
-                img_resized = img.convert("RGB").resize(
-                    (SINGLE_IMG_SIZE, SINGLE_IMG_SIZE)
-                )
+                with span("image_decode"):
+                    img.load()
+                with span("image_resize"):
+                    img_resized = img.convert("RGB").resize(
+                        (SINGLE_IMG_SIZE, SINGLE_IMG_SIZE)
+                    )
 
             # 分组
             group_offset_x = 0 if i < NUM_IMAGES_PER_GROUP else (SINGLE_GROUP_WIDTH + GROUP_SPACING)
@@ -94,6 +98,7 @@ def process_and_move(bp_id):
             combined_img.paste(img_resized, (x, y))
 
         except Exception as e:
+            incr("image_load_failed")
             print(f"❌ 无法处理图片 {img_path}: {e}")
 
     # 5. 分隔线 + 文本
@@ -124,7 +129,9 @@ def process_and_move(bp_id):
 
     # 6. 保存
     save_path = os.path.join(TARGET_DIR, f"BP{bp_id}.png")
-    combined_img.save(save_path, "PNG")
+    with span("png_encode"):
+        combined_img.save(save_path, "PNG")
+    incr("combined_images")
 
     print(f"✅ 已生成带边框图: BP{bp_id}.png")
     return True
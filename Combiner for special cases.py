@@ -2,6 +2,7 @@ import os
 import textwrap
 import itertools
 from PIL import Image, ImageDraw, ImageFont
+from instrumentation import span, incr
 
 # ====================================================================
 # --- 配置参数 ---
@@ -9,8 +10,6 @@ from PIL import Image, ImageDraw, ImageFont
 SOURCE_DIR = "Bongard_Dataset_v2"
 TARGET_DIR = "bongard_augmented_dataset"
 
-os.makedirs(TARGET_DIR, exist_ok=True)
-
 # 你的分类名单 (保持不变)
 RIGHT_7 = [284, 344, 351, 529, 533, 809, 917, 1003, 1008, 1065, 1115, 1122, 1184, 1202, 1283, 559]
 LEFT_7 = [352, 356, 523, 524, 860, 869, 935, 1093, 1116, 1261, 1262, 1275]
@@ -54,7 +53,10 @@ def save_combined_image(bp_id, left_imgs, right_imgs, solution_text, suffix):
     for i, img_path in enumerate(all_imgs):
         try:
             with Image.open(img_path) as img:
-                img_resized = img.convert("RGB").resize((SINGLE_IMG_SIZE, SINGLE_IMG_SIZE))
+                with span("image_decode"):
+                    img.load()
+                with span("image_resize"):
+                    img_resized = img.convert("RGB").resize((SINGLE_IMG_SIZE, SINGLE_IMG_SIZE))
             offset_x = 0 if i < 6 else (SINGLE_GROUP_WIDTH + GROUP_SPACING)
             idx = i if i < 6 else i - 6
             x = offset_x + IMG_PADDING + (idx % 2) * (70)
@@ -62,6 +64,7 @@ def save_combined_image(bp_id, left_imgs, right_imgs, solution_text, suffix):
             draw.rectangle([x-1, y-1, x+60, y+60], outline=(180, 180, 180), width=1)
             combined_img.paste(img_resized, (x, y))
         except Exception as e:
+            incr("image_load_failed")
             print(f"图片加载失败: {e}")
             continue
 
@@ -86,8 +89,10 @@ def save_combined_image(bp_id, left_imgs, right_imgs, solution_text, suffix):
         draw.text((IMG_AREA_WIDTH + TEXT_PADDING, curr_y), line, font=FONT, fill="black")
         curr_y += 22 # 稍微收紧行高，防止文字太长掉出屏幕
 
-    combined_img.save(os.path.join(TARGET_DIR, f"BP{bp_id}_{suffix}.png"))
+    with span("png_encode"):
+        combined_img.save(os.path.join(TARGET_DIR, f"BP{bp_id}_{suffix}.png"))
     total_combined_images += 1
+    incr("combined_images")
 
 def process_special_bp(bp_id):
     global total_folders_processed
@@ -95,6 +100,7 @@ def process_special_bp(bp_id):
     if not os.path.exists(folder_path): return
     
     total_folders_processed += 1
+    os.makedirs(TARGET_DIR, exist_ok=True)
     imgs = sorted([os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.lower().endswith(('.png','.jpg'))])
     sol_path = os.path.join(folder_path, "solution.txt")
     solution = open(sol_path, "r", encoding="utf-8").read().strip() if os.path.exists(sol_path) else ""
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import math
+
+# 拟合出来的温度存在这里，test_qwen_vl.py 的 logits 模式会自动读取
+CALIBRATION_FILE = "answer_calibration.json"
+
+# 温度搜索范围：0.05 ~ 10 (对数均匀)
+TEMPERATURE_GRID = [math.exp(math.log(0.05) + i * (math.log(10) - math.log(0.05)) / 199) for i in range(200)]
+
+
+def load_temperature(path=CALIBRATION_FILE):
+    """
+    读取已拟合的温度，没有校准文件就返回 1.0 (不缩放)
+    """
+    if not os.path.exists(path):
+        return 1.0
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get("temperature", 1.0)
+
+
+def softmax(logits, temperature=1.0):
+    scaled = [v / temperature for v in logits]
+    m = max(scaled)
+    exps = [math.exp(v - m) for v in scaled]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+def negative_log_likelihood(results, temperature):
+    nll = 0.0
+    for r in results:
+        probs = softmax(r['option_logits'], temperature)
+        nll -= math.log(max(probs[ord(r['ground_truth']) - 65], 1e-12))
+    return nll / len(results)
+
+
+def expected_calibration_error(results, temperature, n_bins=10):
+    """
+    ECE：把置信度分桶，比较每个桶内的平均置信度和实际准确率
+    """
+    bins = [[0, 0.0, 0] for _ in range(n_bins)]  # [数量, 置信度之和, 答对数]
+    for r in results:
+        probs = softmax(r['option_logits'], temperature)
+        best = max(range(len(probs)), key=lambda i: probs[i])
+        b = min(int(probs[best] * n_bins), n_bins - 1)
+        bins[b][0] += 1
+        bins[b][1] += probs[best]
+        bins[b][2] += int(chr(65 + best) == r['ground_truth'])
+    return sum(abs(conf - correct) for n, conf, correct in bins if n) / len(results)
+
+
+def fit_temperature(results):
+    """
+    温度缩放 (temperature scaling)：在网格上找使 NLL 最小的 T
+    只用 logits 模式下记录的 option_logits，不需要重新跑模型
+    """
+    results = [r for r in results if r.get('option_logits')]
+    if not results:
+        print("❌ 结果里没有 option_logits，请先用 logits 解码模式跑一遍评测")
+        return None
+
+    best_t = min(TEMPERATURE_GRID, key=lambda t: negative_log_likelihood(results, t))
+    report = {
+        "temperature": round(best_t, 4),
+        "num_questions": len(results),
+        "nll_before": round(negative_log_likelihood(results, 1.0), 4),
+        "nll_after": round(negative_log_likelihood(results, best_t), 4),
+        "ece_before": round(expected_calibration_error(results, 1.0), 4),
+        "ece_after": round(expected_calibration_error(results, best_t), 4)
+    }
+    return report
+
+
+def rank_hard_bps(results, temperature=1.0):
+    """
+    按 "正确答案的平均概率" 从低到高给 BP 排序，越靠前越难
+    """
+    per_bp = {}
+    for r in results:
+        if not r.get('option_logits'):
+            continue
+        bp = r['id'].rsplit('_', 1)[0]
+        probs = softmax(r['option_logits'], temperature)
+        per_bp.setdefault(bp, []).append(probs[ord(r['ground_truth']) - 65])
+
+    ranking = [(bp, sum(p) / len(p)) for bp, p in per_bp.items()]
+    ranking.sort(key=lambda x: x[1])
+    return ranking
+
+
+if __name__ == "__main__":
+    # python answer_calibration.py inference_results_logits.json
+    results_file = sys.argv[1] if len(sys.argv) > 1 else "inference_results_logits.json"
+    with open(results_file, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+
+    report = fit_temperature(results)
+    if report:
+        ranking = rank_hard_bps(results, report["temperature"])
+        report["hardest_bps"] = [{"bp": bp, "mean_correct_prob": round(p, 4)} for bp, p in ranking[:50]]
+
+        with open(CALIBRATION_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+
+        print("=" * 40)
+        print(f"🌡️ 拟合温度 T = {report['temperature']}")
+        print(f"   NLL: {report['nll_before']} -> {report['nll_after']}")
+        print(f"   ECE: {report['ece_before']} -> {report['ece_after']}")
+        print(f"🧱 最难的 5 个 BP:")
+        for item in report["hardest_bps"][:5]:
+            print(f"   {item['bp']}: {item['mean_correct_prob']:.3f}")
+        print(f"💾 校准结果已保存至: {CALIBRATION_FILE}")
+        print("=" * 40)
@@ -0,0 +1,365 @@
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import runpy
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from PIL import Image, ImageDraw
+import instrumentation
+from pipeline import load_script
+
+try:
+    import resource  # Windows 上没有
+except ImportError:
+    resource = None
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_OUTPUT = "benchmark_results.json"
+NUM_BPS = 40          # 合成 BP 数量 (每个 12 张图)
+TILE_SIZE = 110       # 合成小图尺寸，和 oebp.org 原图差不多
+SPECIAL_BP_ID = 284   # 在 RIGHT_7 名单里，用来测 "split for special case.py" 的增强流程
+IMG_EXTS = (".png", ".gif", ".jpg", ".jpeg")
+MCQ_JSON = "bench_mcq.json"
+# 评测阶段会写的东西：拼图缓存 (composite 模式)、回答缓存、结果库 (用假模型时后两个不会写)
+EVAL_OUTPUTS = ("composite_cache", "response_cache.sqlite", "eval_store")
+
+
+# ====================================================================
+# 合成数据：随机线稿 BP 文件夹
+# ====================================================================
+def draw_line_art(rng, size=TILE_SIZE):
+    img = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([0, 0, size - 1, size - 1], outline="black")
+    for _ in range(rng.randint(1, 4)):
+        kind = rng.choice(["line", "ellipse", "polygon"])
+        pts = [(rng.randint(10, size - 10), rng.randint(10, size - 10)) for _ in range(rng.randint(3, 6))]
+        if kind == "line":
+            draw.line(pts, fill="black", width=2)
+        elif kind == "ellipse":
+            x0, y0 = pts[0]
+            r = rng.randint(5, 25)
+            draw.ellipse([x0 - r, y0 - r, x0 + r, y0 + r], outline="black", width=2)
+        else:
+            draw.polygon(pts, outline="black")
+    return img
+
+
+def make_fixture_dataset(root, num_bps=NUM_BPS, seed=0):
+    """
+    生成 BP1..BPn 文件夹 (各 12 张图 + solution.txt)，再加一个 13 张图的特殊 BP
+    返回 {bp_id: [文件名...]}
+    """
+    rng = random.Random(seed)
+    layout = {}
+    bp_ids = list(range(1, num_bps + 1)) + [SPECIAL_BP_ID]
+    for bp_id in bp_ids:
+        folder = os.path.join(root, f"BP{bp_id}")
+        os.makedirs(folder, exist_ok=True)
+        n_imgs = 13 if bp_id == SPECIAL_BP_ID else 12
+        names = []
+        for j in range(n_imgs):
+            name = f"{bp_id * 100 + j}.png"
+            draw_line_art(rng).save(os.path.join(folder, name))
+            names.append(name)
+        with open(os.path.join(folder, "solution.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Synthetic rule {bp_id} vs. not so.")
+        layout[bp_id] = names
+    return layout
+
+
+# ====================================================================
+# 本地 HTTP 替身：模拟 oebp.org 的 BP 页面和 /examples/ 图片
+# ====================================================================
+def start_fake_oebp(fixture_root, layout):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body, content_type):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            host = f"http://127.0.0.1:{self.server.server_address[1]}"
+            if self.path.startswith("/examples/"):
+                _, _, bp, name = self.path.split("/", 3)
+                path = os.path.join(fixture_root, bp, name)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        return self._send(f.read(), "image/png")
+            elif self.path[3:].isdigit() and int(self.path[3:]) in layout:
+                bp_id = int(self.path[3:])
+                imgs = "".join(f'<img src="{host}/examples/BP{bp_id}/{n}">' for n in layout[bp_id])
+                html = (
+                    f"<html><body>{imgs}<table><tr><td><a href=\"/BP{bp_id}\">BP{bp_id}</a></td>"
+                    f"<td>x</td><td>Synthetic rule {bp_id} vs. not so.</td></tr></table></body></html>"
+                )
+                return self._send(html.encode("utf-8"), "text/html")
+            self.send_response(404)
+            self.end_headers()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ====================================================================
+# 计量工具
+# ====================================================================
+def reset_peak_rss():
+    """
+    把进程的内存峰值清零 (Linux: 往 /proc/self/clear_refs 写 5，之后 VmHWM 从当前 RSS 重新算)
+    成功返回 True，这样每个阶段报的是自己的峰值；其他系统做不到，只能报整个进程到目前为止的峰值
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    # Linux 优先读 VmHWM (能被 reset_peak_rss 清零)，ru_maxrss 是整个进程生命周期的峰值
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def output_stats(paths):
+    """
+    本阶段输出 (目录或单个文件，可以是多个) 的总字节数和图片数，不存在的路径算 0
+    """
+    total_bytes, n_images = 0, 0
+    for path in [paths] if isinstance(paths, str) else paths:
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = [os.path.join(dirpath, name) for dirpath, _, names in os.walk(path) for name in names]
+        for full in files:
+            total_bytes += os.path.getsize(full)
+            if full.lower().endswith(IMG_EXTS):
+                n_images += 1
+    return total_bytes, n_images
+
+
+def run_stage(name, fn, outputs, verbose=False):
+    """
+    计时跑一个阶段，统计写出的字节数、图片数、吞吐量和峰值内存 (主进程的，不含子进程)
+    outputs 是本阶段自己写的目录/文件 (只统计这些，不会把前面阶段的输出算进来)
+    fn 返回本阶段处理的图片数 (None 则用输出里新增的图片数)
+    """
+    bytes_before, imgs_before = output_stats(outputs)
+    sink = None if verbose else io.StringIO()
+    per_stage_rss = reset_peak_rss()
+
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext():
+            processed = fn()
+        status = "ok"
+    except ImportError as e:
+        processed, status = 0, f"skipped: {e}"
+    elapsed = time.perf_counter() - start
+
+    bytes_after, imgs_after = output_stats(outputs)
+    if processed is None:
+        processed = imgs_after - imgs_before
+
+    stats = {
+        "status": status,
+        "seconds": round(elapsed, 4),
+        "images": processed,
+        "images_per_sec": round(processed / elapsed, 2) if elapsed > 0 else None,
+        "bytes_written": bytes_after - bytes_before,
+        "peak_rss_mb": peak_rss_mb(),
+        # stage = 本阶段内的峰值；process = 进程启动以来的峰值 (不能清零的系统上，之后的阶段会重复最大值)
+        "peak_rss_scope": "stage" if per_stage_rss else "process",
+    }
+    print(f"⏱️ {name:<10} {stats['seconds']:>8.3f}s  {stats['images']:>6} imgs  "
+          f"{stats['images_per_sec'] or 0:>9.1f} img/s  {stats['bytes_written']:>10} B  [{status}]")
+    return stats
+
+
+# ====================================================================
+# 各阶段
+# ====================================================================
+def stage_crawl(layout, server):
+    scraper = load_script("bp_scraper", "Bongrad-problem scraper.py")
+    scraper.BASE_URL = f"http://127.0.0.1:{server.server_address[1]}/BP"
+    scraper.OUTPUT_DIR = "crawl_out"
+    scraper.REPORT_FILE = os.path.join("crawl_out", "patterns_report.txt")
+    os.makedirs(scraper.OUTPUT_DIR, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=scraper.MAX_WORKERS) as executor:
+        results = list(executor.map(scraper.fetch_problem, sorted(layout)))
+    return sum(len(r["image_paths"]) for r in results if r)
+
+
+def stage_compose(bp_ids):
+    import split
+    split.SOURCE_DIR, split.TARGET_DIR = "Bongard_Dataset_v2", "Bongard_Dataset_v2_new_struct"
+    os.makedirs(split.TARGET_DIR, exist_ok=True)
+    for bp_id in bp_ids:
+        split.process_to_new_struct(bp_id)
+    return len(bp_ids) * 12
+
+
+def stage_augment():
+    special = load_script("split_special", "split for special case.py")
+    special.SOURCE_DIR, special.TARGET_DIR = "Bongard_Dataset_v2", "Bongard_Dataset_v2_new_struct"
+    special.process_special_bp(SPECIAL_BP_ID)
+    return None
+
+
+def stage_training_data():
+    runpy.run_path(os.path.join(REPO_ROOT, "traindata.py"), run_name="__main__")
+    return None
+
+
+def stage_mcq():
+    import mutiple_choice_generate
+    mutiple_choice_generate.build_dual_mcq_dataset("Bongard_Dataset_v2", MCQ_JSON)
+    with open(MCQ_JSON, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+    # 每道题引用 9 张图
+    return len(questions) * 9
+
+
+def stub_predict(messages, decode_mode="generate", temperature=1.0):
+    """
+    假模型：把消息里的图片都解码一遍 (模拟 processor 的读图开销)，然后随便猜一个答案
+    """
+    n_images = 0
+    for part in messages[0]["content"]:
+        if part["type"] == "image":
+            with Image.open(part["image"][len("file://"):]) as img:
+                img.convert("RGB")
+            n_images += 1
+    return "ABCD"[n_images % 4], {"input_tokens": 0}
+
+
+def stage_evaluate(prompt_mode):
+    import test_qwen_vl
+    test_qwen_vl.DATASET_ROOT = os.path.abspath("Bongard_Dataset_v2")
+    test_qwen_vl.JSON_PATH = MCQ_JSON
+    questions = test_qwen_vl.load_questions()
+    test_qwen_vl.evaluate(questions, prompt_mode, "generate", predict_fn=stub_predict)
+    return len(questions) * 9
+
+
+# ====================================================================
+# 主程序
+# ====================================================================
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_benchmark(num_bps=NUM_BPS, seed=0, workdir=None, verbose=False):
+    workdir = workdir or tempfile.mkdtemp(prefix="bongard_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    print(f"🚀 基准测试工作目录: {workdir}")
+
+    try:
+        start = time.perf_counter()
+        layout = make_fixture_dataset("Bongard_Dataset_v2", num_bps, seed)
+        fixture_seconds = time.perf_counter() - start
+        bp_ids = sorted(layout)
+        server = start_fake_oebp(os.path.abspath("Bongard_Dataset_v2"), layout)
+
+        stages = {}
+        try:
+            stages["crawl"] = run_stage("crawl", lambda: stage_crawl(layout, server), "crawl_out", verbose)
+        finally:
+            server.shutdown()
+        stages["compose"] = run_stage("compose", lambda: stage_compose(bp_ids), "Bongard_Dataset_v2_new_struct", verbose)
+        stages["augment"] = run_stage("augment", stage_augment, "Bongard_Dataset_v2_new_struct", verbose)
+        stages["stage"] = run_stage("stage", stage_training_data, "kohya_train_data", verbose)
+        stages["mcq"] = run_stage("mcq", stage_mcq, MCQ_JSON, verbose)
+        stages["evaluate"] = run_stage("evaluate", lambda: stage_evaluate("multi"), EVAL_OUTPUTS, verbose)
+        stages["evaluate_composite"] = run_stage("eval-comp", lambda: stage_evaluate("composite"), EVAL_OUTPUTS, verbose)
+    finally:
+        os.chdir(old_cwd)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"num_bps": num_bps, "seed": seed, "tile_size": TILE_SIZE},
+        "fixture_seconds": round(fixture_seconds, 4),
+        "stages": stages,
+        # 各脚本里 span / 计数器的汇总 (见 instrumentation.py)
+        "metrics": instrumentation.snapshot()
+    }
+
+
+def compare_results(old, new):
+    """
+    打印两次基准测试之间每个阶段的耗时变化
+    """
+    print(f"\n📈 对比 {old['commit'][:8]} -> {new['commit'][:8]}")
+    for name, s in new["stages"].items():
+        o = old["stages"].get(name)
+        if not o or not o["seconds"]:
+            continue
+        change = (s["seconds"] - o["seconds"]) / o["seconds"] * 100
+        flag = "⚠️" if change > 10 else "✅"
+        print(f"  {flag} {name:<20} {o['seconds']:>8.3f}s -> {s['seconds']:>8.3f}s ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bongard 数据流水线基准测试")
+    parser.add_argument("--num-bps", type=int, default=NUM_BPS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="默认用临时目录，跑完删除")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--compare", default=None, help="上一次的结果 JSON，用来对比回归")
+    parser.add_argument("--verbose", action="store_true", help="显示各脚本自己的打印")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bongard_bench_")
+    report = run_benchmark(args.num_bps, args.seed, workdir, args.verbose)
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"💾 结果已保存至: {args.output}")
+
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare_results(json.load(f), report)
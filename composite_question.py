@@ -0,0 +1,108 @@
+import os
+import hashlib
+from PIL import Image, ImageDraw, ImageFont
+from instrumentation import span, incr
+
+# 复用 split.py 里 2x6 拼图的布局常量和贴图函数
+from split import SINGLE_IMG_SIZE, IMG_PADDING, paste_tile
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+# 每道题的拼图缓存目录 (文件名里带 question_id)
+COMPOSITE_CACHE_DIR = "composite_cache"
+
+# 布局常量：上面一行放 5 张 Context，下面一行放 A-D 四个选项
+NUM_CONTEXT = 5
+NUM_OPTIONS = 4
+LABEL_HEIGHT = 24
+ROW_SPACING = 20
+
+CANVAS_WIDTH = NUM_CONTEXT * SINGLE_IMG_SIZE + (NUM_CONTEXT + 1) * IMG_PADDING
+CONTEXT_ROW_Y = LABEL_HEIGHT + IMG_PADDING
+OPTION_ROW_Y = CONTEXT_ROW_Y + SINGLE_IMG_SIZE + ROW_SPACING + LABEL_HEIGHT
+CANVAS_HEIGHT = OPTION_ROW_Y + SINGLE_IMG_SIZE + IMG_PADDING
+
+try:
+    FONT = ImageFont.truetype("arial.ttf", 16)
+except IOError:
+    FONT = ImageFont.load_default()
+
+
+def composite_cache_path(q, dataset_root, cache_dir=COMPOSITE_CACHE_DIR):
+    """
+    缓存文件名 = question_id + (图片列表 + 每张图的大小/修改时间) 的短哈希
+    (同一个 question_id 重新出题后选项变了，或者小图被改过但没改名，就不会误用旧拼图)
+    """
+    bp_folder = os.path.join(dataset_root, q['bp'])
+    parts = []
+    for img in q['context'] + q['options']:
+        path = os.path.join(bp_folder, img)
+        if os.path.exists(path):
+            st = os.stat(path)
+            parts.append(f"{img}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            parts.append(f"{img}:missing")
+    digest = hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(cache_dir, f"{q['question_id']}_{digest}.png")
+
+
+def build_question_composite(q, dataset_root, cache_dir=COMPOSITE_CACHE_DIR):
+    """
+    把一道选择题 (5 张 Context + 4 个选项) 拼成一张大图，返回图片路径
+    已经拼过的题目直接返回缓存
+    """
+    save_path = composite_cache_path(q, dataset_root, cache_dir)
+    if os.path.exists(save_path):
+        incr("composite_cache_hits")
+        return save_path
+    incr("composite_cache_misses")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    bp_folder = os.path.join(dataset_root, q['bp'])
+
+    canvas = Image.new("RGB", (CANVAS_WIDTH, CANVAS_HEIGHT), "white")
+    draw = ImageDraw.Draw(canvas)
+
+    # 1. 第一行：Context 图片
+    draw.text((IMG_PADDING, 4), "Context", font=FONT, fill="black")
+    for i, img in enumerate(q['context'][:NUM_CONTEXT]):
+        x = IMG_PADDING + i * (SINGLE_IMG_SIZE + IMG_PADDING)
+        paste_tile(canvas, draw, os.path.join(bp_folder, img), x, CONTEXT_ROW_Y)
+
+    # 2. 两行之间画一条浅色分割线
+    line_y = CONTEXT_ROW_Y + SINGLE_IMG_SIZE + ROW_SPACING // 2
+    draw.line([(IMG_PADDING, line_y), (CANVAS_WIDTH - IMG_PADDING, line_y)], fill="lightgray", width=1)
+
+    # 3. 第二行：带 A-D 标签的选项
+    for i, img in enumerate(q['options'][:NUM_OPTIONS]):
+        x = IMG_PADDING + i * (SINGLE_IMG_SIZE + IMG_PADDING)
+        draw.text((x, OPTION_ROW_Y - LABEL_HEIGHT + 4), f"Option {chr(65 + i)}", font=FONT, fill="black")
+        paste_tile(canvas, draw, os.path.join(bp_folder, img), x, OPTION_ROW_Y)
+
+    with span("png_encode"):
+        canvas.save(save_path, "PNG")
+    return save_path
+
+
+def build_all_composites(questions, dataset_root, cache_dir=COMPOSITE_CACHE_DIR):
+    """
+    提前把所有题目的拼图生成好 (评测时就只剩读缓存)
+    """
+    built = 0
+    for q in questions:
+        if not os.path.exists(composite_cache_path(q, dataset_root, cache_dir)):
+            build_question_composite(q, dataset_root, cache_dir)
+            built += 1
+    print(f"🧩 拼图缓存完成：新生成 {built} 张，共 {len(questions)} 道题")
+
+
+if __name__ == "__main__":
+    import json
+
+    DATASET_ROOT = "Bongard_Dataset_v2"
+    JSON_PATH = "bongard_v2_dual_tasks.json"
+
+    with open(JSON_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    build_all_composites(data['questions'], DATASET_ROOT)
@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import importlib
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image, ImageFilter
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+# 要建索引的目录：原始小图、combined.png 拼图、增强数据、Kohya 训练图
+SOURCES = [
+    "Bongard_Dataset_v2",
+    "Bongard_Dataset_v2_new_struct",
+    "Dataset for training/bongard_augmented_dataset",
+    "kohya_train_data",
+]
+INDEX_DIR = "embedding_index"
+VECTORS_FILE = "vectors.f16"   # (count, dim) float16，按行追加，用 np.memmap 读
+META_FILE = "meta.json"
+IVF_FILE = "ivf.npz"
+
+VALID_EXTS = (".png", ".gif", ".jpg", ".jpeg", ".bmp")
+ENCODER = "pixels"
+BATCH_SIZE = 256
+SEARCH_CHUNK = 65536           # 精确搜索时每次从 memmap 读多少行
+NUM_WORKERS = os.cpu_count() or 4
+
+# IVF / PQ 默认参数
+IVF_NLIST = 64
+IVF_NPROBE = 8
+PQ_M = 16                      # 子空间个数，每个子空间 256 个码字 (1 字节)
+KMEANS_ITERS = 20
+KMEANS_SAMPLE = 50000
+
+
+# ====================================================================
+# 可插拔的 CPU 编码器
+# ====================================================================
+# 名字 -> (维度, "模块:函数")。子进程按这个路径自己 import 编码函数
+# (Windows 上进程池是 spawn，子进程看不到主进程运行时注册进字典的函数对象)
+ENCODERS = {}
+_resolved_encoders = {}
+
+
+def register_encoder(name, dim, fn):
+    """
+    注册一个编码器，例如换成 CLIP：
+        register_encoder("clip", 512, "my_clip:encode")
+    fn 是 "模块:函数" 路径 (也可以直接传模块顶层函数，会自动转成路径)
+    fn(path) -> np.ndarray (dim,) float32
+    """
+    if callable(fn):
+        if fn.__module__ == "__main__" or "<" in fn.__qualname__:
+            raise ValueError(f"编码器 {name} 必须是可 import 的模块顶层函数 (不能是 lambda / __main__ 里的函数)，"
+                             f"请传 \"模块:函数\" 路径")
+        fn = f"{fn.__module__}:{fn.__qualname__}"
+    ENCODERS[name] = (dim, fn)
+
+
+def resolve_encoder(spec):
+    """
+    "模块:函数" -> 函数对象 (每个进程只 import 一次)
+    """
+    if spec not in _resolved_encoders:
+        module_name, _, attr = spec.partition(":")
+        obj = importlib.import_module(module_name)
+        for part in attr.split("."):
+            obj = getattr(obj, part)
+        _resolved_encoders[spec] = obj
+    return _resolved_encoders[spec]
+
+
+def encoder_spec(name, meta=None):
+    """
+    编码器名字 -> "模块:函数"：先查本进程注册的，再查索引 meta.json 里记下的
+    """
+    if name in ENCODERS:
+        return ENCODERS[name][1]
+    if meta and meta.get("encoder") == name and meta.get("encoder_spec"):
+        return meta["encoder_spec"]
+    raise KeyError(f"未注册的编码器: {name}")
+
+
+def encode_pixels(path, size=32):
+    """
+    默认编码器：透明背景铺白 -> 灰度 -> 轻微模糊 (容忍几个像素的偏移) -> 32x32 -> 墨迹=1
+    """
+    with Image.open(path) as img:
+        rgba = img.convert("RGBA")
+        canvas = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        canvas.alpha_composite(rgba)
+        gray = canvas.convert("L").filter(ImageFilter.GaussianBlur(radius=max(1, rgba.width // 64)))
+        gray = gray.resize((size, size), Image.BILINEAR)
+    vec = 1.0 - np.asarray(gray, dtype=np.float32).ravel() / 255.0
+    return vec - vec.mean()
+
+
+register_encoder("pixels", 32 * 32, "embedding_index:encode_pixels")
+
+
+def _encode_one(args):
+    """
+    子进程任务：(编码器路径, 图片路径) -> (向量, None) 或 (None, 错误信息)
+    """
+    spec, path = args
+    try:
+        return resolve_encoder(spec)(path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-6)
+
+
+# ====================================================================
+# 索引存储
+# ====================================================================
+def scan_sources(sources=SOURCES):
+    paths = []
+    for root in sources:
+        if not os.path.exists(root):
+            continue
+        for dirpath, _, files in os.walk(root):
+            for name in sorted(files):
+                if name.lower().endswith(VALID_EXTS):
+                    paths.append(os.path.join(dirpath, name))
+    return paths
+
+
+def load_meta(index_dir=INDEX_DIR):
+    path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def open_vectors(index_dir=INDEX_DIR, meta=None):
+    meta = meta or load_meta(index_dir)
+    if not meta or meta["count"] == 0:
+        return np.zeros((0, meta["dim"] if meta else 1), dtype=np.float16)
+    return np.memmap(os.path.join(index_dir, VECTORS_FILE), dtype=np.float16, mode="r",
+                     shape=(meta["count"], meta["dim"]))
+
+
+def add_images(paths, index_dir=INDEX_DIR, encoder=ENCODER, num_workers=NUM_WORKERS):
+    """
+    增量添加：已经在索引里的路径跳过，新图片分批编码后追加到 vectors.f16 末尾
+    如果已经训练过 IVF，新向量直接分配到已有的倒排列表里
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    meta = load_meta(index_dir) or {"encoder": encoder, "dim": ENCODERS[encoder][0], "count": 0, "paths": []}
+    if meta["encoder"] != encoder:
+        raise ValueError(f"索引是用 {meta['encoder']} 编码的，不能混用 {encoder}")
+    spec = encoder_spec(encoder, meta)
+    meta["encoder_spec"] = spec
+
+    known = set(meta["paths"])
+    new_paths = [p for p in paths if p not in known]
+    print(f"🧮 新增 {len(new_paths)} 张图片 (索引里已有 {meta['count']} 张)")
+    if not new_paths:
+        return meta
+
+    # 上次构建中途崩溃时，vectors.f16 会比 meta.json 记录的多出几批：先截掉，
+    # 否则新向量会接在这些多余的行后面，和 paths 对不上
+    vectors_path = os.path.join(index_dir, VECTORS_FILE)
+    expected_bytes = meta["count"] * meta["dim"] * np.dtype(np.float16).itemsize
+    if os.path.exists(vectors_path) and os.path.getsize(vectors_path) != expected_bytes:
+        print(f"⚠ {VECTORS_FILE} 和 {META_FILE} 不一致，截断到 {meta['count']} 行")
+        os.truncate(vectors_path, expected_bytes)
+
+    start = time.perf_counter()
+    added_vectors = []
+    failures = []  # (路径, 错误信息)，编码失败的图片不进索引，下次 build 会重试
+    with Pool(num_workers) as pool, open(vectors_path, "ab") as f:
+        for s in range(0, len(new_paths), BATCH_SIZE):
+            batch = new_paths[s:s + BATCH_SIZE]
+            results = pool.map(_encode_one, [(spec, p) for p in batch])
+            failures.extend((batch[i], err) for i, (v, err) in enumerate(results) if v is None)
+            ok = [i for i, (v, _) in enumerate(results) if v is not None]
+            if not ok:
+                continue
+            block = _normalize(np.stack([results[i][0] for i in ok])).astype(np.float16)
+            f.write(block.tobytes())
+            meta["paths"].extend(batch[i] for i in ok)
+            added_vectors.append(block)
+        pool.close()  # 正常收尾 (不被 terminate)，子进程的埋点才会导出
+        pool.join()
+
+    meta["count"] = len(meta["paths"])
+    with open(os.path.join(index_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    ivf = load_ivf(index_dir)
+    if ivf is not None and added_vectors:
+        new_vecs = np.concatenate(added_vectors).astype(np.float32)
+        first_row = meta["count"] - len(new_vecs)
+        _ivf_append(ivf, new_vecs, np.arange(first_row, meta["count"]))
+        save_ivf(index_dir, ivf)
+
+    print(f"💾 索引共 {meta['count']} 张，本次编码耗时 {time.perf_counter() - start:.1f}s")
+    if failures:
+        print(f"⚠ {len(failures)} 张图片编码失败 (编码器 {spec})：")
+        for path, err in failures[:5]:
+            print(f"   ❌ {path}: {err}")
+        if len(failures) == len(new_paths):
+            raise RuntimeError(f"编码器 {spec} 一张图片都没编码成功，检查编码器能否在子进程里 import: {failures[0][1]}")
+    return meta
+
+
+# ====================================================================
+# 精确 top-k (分块矩阵乘法)
+# ====================================================================
+def search_exact(queries, k=10, index_dir=INDEX_DIR):
+    """
+    queries: (Q, dim) 已归一化。对整张 memmap 分块做 queries @ chunk.T，保留每块的 top-k 再合并
+    返回 (scores, rows) 两个 (Q, k) 数组
+    """
+    vectors = open_vectors(index_dir)
+    q = np.asarray(queries, dtype=np.float32)
+    best_s = np.full((len(q), 0), -np.inf, dtype=np.float32)
+    best_i = np.zeros((len(q), 0), dtype=np.int64)
+
+    for s in range(0, len(vectors), SEARCH_CHUNK):
+        chunk = np.asarray(vectors[s:s + SEARCH_CHUNK], dtype=np.float32)
+        scores = q @ chunk.T
+        kk = min(k, scores.shape[1])
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        best_s = np.concatenate([best_s, np.take_along_axis(scores, part, axis=1)], axis=1)
+        best_i = np.concatenate([best_i, part + s], axis=1)
+        if best_s.shape[1] > k:
+            keep = np.argpartition(-best_s, k - 1, axis=1)[:, :k]
+            best_s = np.take_along_axis(best_s, keep, axis=1)
+            best_i = np.take_along_axis(best_i, keep, axis=1)
+
+    order = np.argsort(-best_s, axis=1)
+    return np.take_along_axis(best_s, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+
+# ====================================================================
+# 可选的 IVF / PQ 近似搜索
+# ====================================================================
+def kmeans(x, k, iters=KMEANS_ITERS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=min(k, len(x)), replace=False)].copy()
+    x_sq = (x ** 2).sum(axis=1, keepdims=True)
+    for _ in range(iters):
+        d = x_sq - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)
+        assign = d.argmin(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=len(centroids))[:, None]
+        empty = counts[:, 0] == 0
+        centroids = np.where(empty[:, None], centroids, sums / np.maximum(counts, 1))
+    return centroids
+
+
+def _assign(x, centroids):
+    return (x @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1)).argmax(axis=1)
+
+
+def _pq_encode(residuals, codebooks):
+    m, ksub, dsub = codebooks.shape
+    codes = np.empty((len(residuals), m), dtype=np.uint8)
+    for j in range(m):
+        codes[:, j] = _assign(residuals[:, j * dsub:(j + 1) * dsub], codebooks[j])
+    return codes
+
+
+def train_ivf(index_dir=INDEX_DIR, nlist=IVF_NLIST, pq_m=PQ_M):
+    """
+    训练 IVF 粗聚类 + 残差 PQ，倒排列表存成 (按列表排序的行号, 每个列表的起点)
+    pq_m=0 表示不用 PQ，只用 IVF 缩小候选范围后做精确打分
+    """
+    vectors = open_vectors(index_dir)
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(len(vectors), size=min(KMEANS_SAMPLE, len(vectors)), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    start = time.perf_counter()
+    centroids = kmeans(sample, nlist).astype(np.float32)
+    ivf = {"centroids": centroids, "rows": np.zeros(0, dtype=np.int64), "lists": np.zeros(0, dtype=np.int32)}
+    if pq_m:
+        dim = vectors.shape[1]
+        if dim % pq_m:
+            raise ValueError(f"维度 {dim} 不能被 PQ_M={pq_m} 整除")
+        dsub = dim // pq_m
+        residuals = sample - centroids[_assign(sample, centroids)]
+        ivf["codebooks"] = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], 256) for j in range(pq_m)
+        ]).astype(np.float32)
+        ivf["codes"] = np.zeros((0, pq_m), dtype=np.uint8)
+
+    for s in range(0, len(vectors), SEARCH_CHUNK):
+        chunk = np.asarray(vectors[s:s + SEARCH_CHUNK], dtype=np.float32)
+        _ivf_append(ivf, chunk, np.arange(s, s + len(chunk)))
+
+    save_ivf(index_dir, ivf)
+    print(f"🗂️ IVF 训练完成：{nlist} 个列表，PQ={pq_m or '无'}，耗时 {time.perf_counter() - start:.1f}s")
+    return ivf
+
+
+def _ivf_append(ivf, vecs, rows):
+    lists = _assign(vecs, ivf["centroids"]).astype(np.int32)
+    ivf["rows"] = np.concatenate([ivf["rows"], rows])
+    ivf["lists"] = np.concatenate([ivf["lists"], lists])
+    if "codebooks" in ivf:
+        ivf["codes"] = np.concatenate([ivf["codes"], _pq_encode(vecs - ivf["centroids"][lists], ivf["codebooks"])])
+
+
+def save_ivf(index_dir, ivf):
+    np.savez(os.path.join(index_dir, IVF_FILE), **ivf)
+
+
+def load_ivf(index_dir=INDEX_DIR):
+    path = os.path.join(index_dir, IVF_FILE)
+    if not os.path.exists(path):
+        return None
+    data = np.load(path)
+    return {k: data[k] for k in data.files}
+
+
+def search_ivf(queries, k=10, nprobe=IVF_NPROBE, index_dir=INDEX_DIR, rerank=True):
+    """
+    近似搜索：每个查询只看最近的 nprobe 个倒排列表
+    有 PQ 时先用查表 (ADC) 打分，rerank=True 再对前 4k 个候选从 memmap 读原向量精确重排
+    """
+    ivf = load_ivf(index_dir)
+    if ivf is None:
+        raise FileNotFoundError("还没有训练 IVF，请先运行: python embedding_index.py train-ivf")
+    vectors = open_vectors(index_dir)
+    q = np.asarray(queries, dtype=np.float32)
+    coarse = q @ ivf["centroids"].T
+    probes = np.argsort(-coarse, axis=1)[:, :nprobe]
+
+    all_scores, all_rows = [], []
+    for qi in range(len(q)):
+        sel = np.flatnonzero(np.isin(ivf["lists"], probes[qi]))
+        rows = ivf["rows"][sel]
+        if "codebooks" in ivf:
+            m, ksub, dsub = ivf["codebooks"].shape
+            table = np.einsum("mkd,md->mk", ivf["codebooks"], q[qi].reshape(m, dsub))  # (m, 256)
+            approx = coarse[qi, ivf["lists"][sel]] + table[np.arange(m), ivf["codes"][sel]].sum(axis=1)
+            if rerank:
+                top = np.argsort(-approx)[:4 * k]
+                rows = rows[top]
+                scores = np.asarray(vectors[np.sort(rows)], dtype=np.float32) @ q[qi]
+                rows = np.sort(rows)
+            else:
+                scores = approx
+        else:
+            order = np.argsort(rows)
+            rows = rows[order]
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ q[qi]
+        top = np.argsort(-scores)[:k]
+        all_scores.append(scores[top])
+        all_rows.append(rows[top])
+    return all_scores, all_rows
+
+
+# ====================================================================
+# 查询接口
+# ====================================================================
+def query_images(paths, k=10, mode="exact", index_dir=INDEX_DIR):
+    meta = load_meta(index_dir)
+    spec = encoder_spec(meta["encoder"], meta)
+    vecs = []
+    for p in paths:
+        vec, err = _encode_one((spec, p))
+        if vec is None:
+            raise ValueError(f"无法编码查询图片 {p} (编码器 {spec}): {err}")
+        vecs.append(vec)
+    q = _normalize(np.stack(vecs))
+    start = time.perf_counter()
+    if mode == "ivf":
+        scores, rows = search_ivf(q, k, index_dir=index_dir)
+    else:
+        scores, rows = search_exact(q, k, index_dir)
+    elapsed = time.perf_counter() - start
+    results = [
+        [(meta["paths"][r], float(s)) for s, r in zip(sc, rw)]
+        for sc, rw in zip(scores, rows)
+    ]
+    return results, elapsed
+
+
+if __name__ == "__main__":
+    # python embedding_index.py build              -> 扫描 SOURCES，增量编码新图片
+    # python embedding_index.py train-ivf          -> 训练 IVF/PQ 近似索引 (可选)
+    # python embedding_index.py query img.png [k] [exact|ivf]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if cmd == "build":
+        add_images(scan_sources())
+    elif cmd == "train-ivf":
+        train_ivf()
+    elif cmd == "query":
+        k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        mode = sys.argv[4] if len(sys.argv) > 4 else "exact"
+        results, elapsed = query_images([sys.argv[2]], k, mode)
+        for path, score in results[0]:
+            print(f"{score:.4f}  {path}")
+        print(f"⏱️ 查询耗时: {elapsed * 1000:.1f}ms ({mode})")
+    else:
+        print(f"❌ 未知命令: {cmd}")
@@ -0,0 +1,263 @@
+import os
+import re
+import sys
+import json
+import time
+import numpy as np
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+# 只追加的按列存储：每次评测写一个新的 part-<run_id>.npz，旧文件永远不改
+# runs.jsonl 每行一条 run 的元信息 (模型、提示方式、题库、时间、准确率)
+STORE_DIR = "eval_store"
+RUNS_FILE = "runs.jsonl"
+QUESTIONS_JSON = "bongard_v2_refined_rules.json"
+
+# 每道题一行，这些列都是 numpy 数组
+COLUMNS = {
+    "run_id": str,
+    "model": str,
+    "prompt_mode": str,
+    "decode_mode": str,
+    "question_id": str,
+    "bp": str,
+    "target_side": str,
+    "prediction": str,
+    "ground_truth": str,
+    "is_correct": bool,
+    "latency_s": np.float32,    # 响应缓存命中的题没有真正推理，为 NaN
+    "input_tokens": np.int32,
+    "confidence": np.float32,   # 只有 logits 解码才有，其他为 NaN
+}
+
+
+def model_name(model_path):
+    """
+    D:\\qwenVL\\Qwen3-VL-8B-Instruct -> Qwen3-VL-8B-Instruct (Windows / Linux 路径都能处理)
+    """
+    return [p for p in re.split(r"[\\/]", model_path) if p][-1]
+
+
+def new_run_id(prompt_mode, decode_mode):
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{prompt_mode}-{decode_mode}"
+
+
+# ====================================================================
+# 写入
+# ====================================================================
+def append_run(results, model, run_id=None, store_dir=STORE_DIR, questions_json=None):
+    """
+    把 test_qwen_vl.evaluate() 的结果列表写成一个新的 part 文件
+    同一个 run_id 已经存在就报错 (只追加，不覆盖)
+    """
+    if not results:
+        return None
+    os.makedirs(store_dir, exist_ok=True)
+    prompt_mode, decode_mode = results[0]["prompt_mode"], results[0]["decode_mode"]
+    run_id = run_id or new_run_id(prompt_mode, decode_mode)
+    part_path = os.path.join(store_dir, f"part-{run_id}.npz")
+    if os.path.exists(part_path):
+        raise FileExistsError(f"run {run_id} 已经存在: {part_path}")
+
+    n = len(results)
+    columns = {
+        "run_id": np.full(n, run_id),
+        "model": np.full(n, model),
+        "prompt_mode": np.array([r["prompt_mode"] for r in results]),
+        "decode_mode": np.array([r["decode_mode"] for r in results]),
+        "question_id": np.array([r["id"] for r in results]),
+        # 旧的结果文件没有 bp 字段：question_id 形如 BP10_Pos，去掉最后一段就是 bp
+        "bp": np.array([r.get("bp") or r["id"].rsplit("_", 1)[0] for r in results]),
+        "target_side": np.array([r["target_side"] for r in results]),
+        "prediction": np.array([r["prediction"] for r in results]),
+        "ground_truth": np.array([r["ground_truth"] for r in results]),
+        "is_correct": np.array([r["is_correct"] for r in results], dtype=bool),
+        "latency_s": np.array([r["latency_s"] for r in results], dtype=np.float32),
+        "input_tokens": np.array([r.get("input_tokens", 0) for r in results], dtype=np.int32),
+        "confidence": np.array([r.get("confidence", np.nan) for r in results], dtype=np.float32),
+    }
+    # 先写临时文件再改名，中途崩溃不会留下半个 part
+    tmp_path = part_path + ".tmp.npz"
+    np.savez(tmp_path, **columns)
+    os.replace(tmp_path, part_path)
+
+    meta = {
+        "run_id": run_id,
+        "model": model,
+        "prompt_mode": prompt_mode,
+        "decode_mode": decode_mode,
+        "questions_json": questions_json,
+        "count": n,
+        "accuracy": float(columns["is_correct"].mean()),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(store_dir, RUNS_FILE), "a", encoding="utf-8") as f:
+        f.write(json.dumps(meta, ensure_ascii=False) + "\n")
+    print(f"🗄️ 评测结果已追加到 {store_dir} (run_id={run_id}, {n} 题)")
+    return run_id
+
+
+# ====================================================================
+# 读取
+# ====================================================================
+def load_runs(store_dir=STORE_DIR):
+    path = os.path.join(store_dir, RUNS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_table(store_dir=STORE_DIR, run_ids=None):
+    """
+    把所有 (或指定的) part 文件按列拼成一张表：{列名: 数组}
+    """
+    runs = [r["run_id"] for r in load_runs(store_dir)]
+    if run_ids is not None:
+        runs = [r for r in runs if r in set(run_ids)]
+    parts = []
+    for run_id in runs:
+        path = os.path.join(store_dir, f"part-{run_id}.npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                parts.append({k: data[k] for k in data.files})
+    if not parts:
+        return {name: np.array([], dtype=object if kind is str else kind) for name, kind in COLUMNS.items()}
+    return {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+
+
+def load_question_table(questions_json=QUESTIONS_JSON):
+    with open(questions_json, "r", encoding="utf-8") as f:
+        questions = json.load(f)["questions"]
+    return {
+        "question_id": np.array([q["question_id"] for q in questions]),
+        "rule_description": np.array([q["rule_description"] for q in questions]),
+        "correct_image": np.array([q["correct_image"] for q in questions]),
+    }
+
+
+# ====================================================================
+# 向量化查询
+# ====================================================================
+def select(table, mask=None, **equals):
+    """
+    select(t, run_id="...", target_side="left") -> 过滤后的新表
+    """
+    n = len(table["question_id"])
+    keep = np.ones(n, dtype=bool) if mask is None else mask.copy()
+    for col, value in equals.items():
+        keep &= table[col] == value
+    return {k: v[keep] for k, v in table.items()}
+
+
+def join(table, other, on="question_id"):
+    """
+    左连接：按 on 列把 other 的其他列加到 table 上 (找不到的填空字符串)
+    用排序 + searchsorted，不逐行查字典
+    """
+    order = np.argsort(other[on])
+    keys = other[on][order]
+    pos = np.clip(np.searchsorted(keys, table[on]), 0, max(len(keys) - 1, 0))
+    found = keys[pos] == table[on] if len(keys) else np.zeros(len(table[on]), dtype=bool)
+    out = dict(table)
+    for col, values in other.items():
+        if col == on:
+            continue
+        joined = values[order][pos] if len(keys) else np.full(len(table[on]), "", dtype=object)
+        out[col] = np.where(found, joined, "")
+    return out
+
+
+def accuracy_by(table, keys):
+    """
+    按一列或多列分组，返回 {"keys": {列: 组值数组}, "count", "correct", "accuracy"}
+    例如 accuracy_by(t, ["run_id", "bp"]) / accuracy_by(t, ["run_id", "target_side"])
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    codes, uniques = [], []
+    for col in keys:
+        u, inv = np.unique(table[col], return_inverse=True)
+        uniques.append(u)
+        codes.append(inv)
+    # 多列编码合成一个整数再 unique，一次 bincount 算完所有组
+    combined = np.zeros(len(table[keys[0]]), dtype=np.int64)
+    for u, c in zip(uniques, codes):
+        combined = combined * len(u) + c
+    groups, inv = np.unique(combined, return_inverse=True)
+    count = np.bincount(inv, minlength=len(groups))
+    correct = np.bincount(inv, weights=table["is_correct"], minlength=len(groups)).astype(np.int64)
+
+    group_keys, rem = {}, groups
+    for col, u in reversed(list(zip(keys, uniques))):
+        group_keys[col] = u[rem % len(u)]
+        rem = rem // len(u)
+    return {
+        "keys": {col: group_keys[col] for col in keys},
+        "count": count,
+        "correct": correct,
+        "accuracy": correct / np.maximum(count, 1),
+    }
+
+
+def run_diff(table, run_a, run_b):
+    """
+    两次 run 在共同题目上的对比：修好了 (错 -> 对)、改坏了 (对 -> 错)、答案变了的题
+    """
+    a, b = select(table, run_id=run_a), select(table, run_id=run_b)
+    common, ia, ib = np.intersect1d(a["question_id"], b["question_id"], return_indices=True)
+    ca, cb = a["is_correct"][ia], b["is_correct"][ib]
+    return {
+        "common": int(len(common)),
+        "accuracy_a": float(ca.mean()) if len(common) else 0.0,
+        "accuracy_b": float(cb.mean()) if len(common) else 0.0,
+        "fixed": common[~ca & cb].tolist(),
+        "broken": common[ca & ~cb].tolist(),
+        "changed_answer": int((a["prediction"][ia] != b["prediction"][ib]).sum()),
+    }
+
+
+# ====================================================================
+# 命令行
+# ====================================================================
+def print_groups(stats, limit=20, worst_first=True):
+    order = np.lexsort((-stats["count"], stats["accuracy"] if worst_first else -stats["accuracy"]))
+    cols = list(stats["keys"])
+    for i in order[:limit]:
+        label = "  ".join(str(stats["keys"][c][i]) for c in cols)
+        print(f"   {label:<48} {stats['correct'][i]:>5}/{stats['count'][i]:<5} {stats['accuracy'][i] * 100:>6.1f}%")
+
+
+if __name__ == "__main__":
+    # python eval_store.py runs                    -> 列出所有 run 和准确率
+    # python eval_store.py bp [run_id]             -> 每个 BP 的准确率 (最差的在前)
+    # python eval_store.py side                    -> 每个 run 左/右规则的准确率
+    # python eval_store.py rules [run_id] [json]   -> 连上 rule_description，看哪些规则最难
+    # python eval_store.py diff <run_a> <run_b>    -> 两次 run 逐题对比
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "runs"
+    start = time.perf_counter()
+
+    if cmd == "runs":
+        runs = load_runs()
+        print(f"{'run_id':<36}{'模型':<28}{'题数':>6}{'准确率':>9}")
+        for r in runs:
+            print(f"{r['run_id']:<36}{r['model']:<28}{r['count']:>6}{r['accuracy'] * 100:>8.2f}%")
+    elif cmd == "bp":
+        t = load_table(run_ids=sys.argv[2:3] or None)
+        print_groups(accuracy_by(t, ["run_id", "bp"]))
+    elif cmd == "side":
+        t = load_table()
+        print_groups(accuracy_by(t, ["run_id", "prompt_mode", "target_side"]), limit=200, worst_first=False)
+    elif cmd == "rules":
+        t = load_table(run_ids=sys.argv[2:3] or None)
+        q = load_question_table(sys.argv[3] if len(sys.argv) > 3 else QUESTIONS_JSON)
+        print_groups(accuracy_by(join(t, q), ["target_side", "rule_description"]))
+    elif cmd == "diff":
+        d = run_diff(load_table(run_ids=sys.argv[2:4]), sys.argv[2], sys.argv[3])
+        print(f"共同题目 {d['common']}：准确率 {d['accuracy_a'] * 100:.2f}% -> {d['accuracy_b'] * 100:.2f}%")
+        print(f"✅ 修好了 {len(d['fixed'])} 题，❌ 改坏了 {len(d['broken'])} 题，答案变化 {d['changed_answer']} 题")
+        for qid in d["broken"][:20]:
+            print(f"   ❌ {qid}")
+    else:
+        print(f"❌ 未知命令: {cmd}")
+    print(f"⏱️ 查询耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
@@ -0,0 +1,200 @@
+import os
+import json
+import shutil
+import hashlib
+from multiprocessing import Pool
+from PIL import Image
+
+from split import SINGLE_IMG_SIZE
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+SOURCE_DIR = "Bongard_Dataset_v2"
+TARGET_DIR = "Bongard_Dataset_v2_normalized"
+MANIFEST_FILE = "manifest.json"
+
+# 爬虫下下来的原图格式很杂 (PNG/GIF/JPG，还有个别 BMP)，统一转成下面的规格
+VALID_EXTS = (".png", ".gif", ".jpg", ".jpeg", ".bmp")
+CANONICAL_MODE = "RGB"
+CANONICAL_SIZE = (SINGLE_IMG_SIZE, SINGLE_IMG_SIZE)  # 和 split.py 拼图里的小图一样大，拼图时不用再缩放
+NUM_WORKERS = os.cpu_count() or 4
+
+
+def sha1_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def normalize_image(job):
+    """
+    在子进程里处理一张图：完整校验 -> 透明背景铺白 -> 转 RGB -> 缩放 -> 存 PNG
+    返回这张图的清单记录
+    """
+    src, dst = job
+    entry = {"source": src, "output": dst, "ok": False}
+    try:
+        with open(src, "rb") as f:
+            raw = f.read()
+        entry["sha1"] = hashlib.sha1(raw).hexdigest()
+        entry["bytes"] = len(raw)
+
+        # 1. verify() 检查文件结构 (截断/损坏)，之后必须重新打开才能解码
+        with Image.open(src) as img:
+            img.verify()
+
+        with Image.open(src) as img:
+            img.load()
+            entry["format"], entry["mode"], entry["size"] = img.format, img.mode, list(img.size)
+
+            # 2. 带透明通道的图直接 convert("RGB") 会变成黑底，先铺到白底上
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                rgba = img.convert("RGBA")
+                canvas = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+                canvas.alpha_composite(rgba)
+                out = canvas.convert(CANONICAL_MODE)
+            else:
+                out = img.convert(CANONICAL_MODE)
+
+            if out.size != CANONICAL_SIZE:
+                out = out.resize(CANONICAL_SIZE, Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        out.save(dst, "PNG", optimize=False)
+        entry["ok"] = True
+    except Exception as e:
+        entry["error"] = f"{type(e).__name__}: {e}"
+    return entry
+
+
+def collect_jobs(source_dir=SOURCE_DIR, target_dir=TARGET_DIR):
+    """
+    列出所有 BP 文件夹里的原图，决定输出文件名 (统一改成 .png)
+    同一个 BP 里出现 1.gif 和 1.png 这种重名时记为失败，不互相覆盖
+    """
+    jobs, failures, bp_images = [], [], {}
+    folders = [d for d in os.listdir(source_dir) if d.startswith("BP") and os.path.isdir(os.path.join(source_dir, d))]
+
+    for folder in sorted(folders, key=lambda x: int(x[2:]) if x[2:].isdigit() else 0):
+        src_folder = os.path.join(source_dir, folder)
+        files = sorted(f for f in os.listdir(src_folder) if f.lower().endswith(VALID_EXTS))
+        seen = set()
+        bp_images[folder] = []
+        for f in files:
+            out_name = os.path.splitext(f)[0] + ".png"
+            src = os.path.join(src_folder, f)
+            if out_name in seen:
+                failures.append({"source": src, "ok": False, "error": f"输出文件名冲突: {out_name}"})
+                continue
+            seen.add(out_name)
+            jobs.append((src, os.path.join(target_dir, folder, out_name)))
+            bp_images[folder].append(out_name)
+    return jobs, failures, bp_images
+
+
+def remove_orphans(target_dir, entries, bp_images):
+    """
+    删掉已经没有有效清单记录的输出：源图后来校验失败/被删了，旧的规范化结果不能留在目录里被下游当成有效图
+    整个 BP 文件夹都没了的，连 solution.txt 和空文件夹一起删；返回删掉的图片数
+    """
+    keep = {os.path.normpath(e["output"]) for e in entries if e["ok"]}
+    removed = 0
+    for folder in os.listdir(target_dir):
+        out_folder = os.path.join(target_dir, folder)
+        if not os.path.isdir(out_folder):
+            continue
+        for name in os.listdir(out_folder):
+            full = os.path.join(out_folder, name)
+            if name.lower().endswith(".png") and os.path.normpath(full) not in keep:
+                os.remove(full)
+                removed += 1
+            elif name == "solution.txt" and folder not in bp_images:
+                os.remove(full)
+        if not os.listdir(out_folder):
+            os.rmdir(out_folder)
+    return removed
+
+
+def run_ingest(source_dir=SOURCE_DIR, target_dir=TARGET_DIR, num_workers=NUM_WORKERS):
+    os.makedirs(target_dir, exist_ok=True)
+    manifest_path = os.path.join(target_dir, MANIFEST_FILE)
+
+    # 上一次的清单：源文件没变 (sha1 一样) 且输出还在的就跳过
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = {e["source"]: e for e in json.load(f)["images"]}
+
+    jobs, entries, bp_images = collect_jobs(source_dir, target_dir)
+    todo = []
+    for src, dst in jobs:
+        old = previous.get(src)
+        # 先比大小 (便宜)，大小一样再比 sha1，重新下载/修好的同样大小的图也会被重新处理
+        if (old and old["ok"] and os.path.exists(dst) and old.get("bytes") == os.path.getsize(src)
+                and old.get("sha1") == sha1_file(src)):
+            entries.append(old)
+        else:
+            todo.append((src, dst))
+
+    print(f"🚀 共 {len(jobs)} 张原图，需要处理 {len(todo)} 张 ({num_workers} 个进程)...")
+    with Pool(num_workers) as pool:
+        entries.extend(pool.imap_unordered(normalize_image, todo, chunksize=32))
+        pool.close()  # 正常收尾 (不被 terminate)，子进程的埋点才会导出
+        pool.join()
+
+    # solution.txt 原样拷过去
+    for folder in bp_images:
+        src_txt = os.path.join(source_dir, folder, "solution.txt")
+        if os.path.exists(src_txt):
+            shutil.copy(src_txt, os.path.join(target_dir, folder, "solution.txt"))
+
+    orphans = remove_orphans(target_dir, entries, bp_images)
+
+    # 每个 BP 的有效图片数，下游按这个判断是不是正好 12 张
+    ok_by_bp = {}
+    for e in entries:
+        if e["ok"]:
+            folder = os.path.basename(os.path.dirname(e["output"]))
+            ok_by_bp[folder] = ok_by_bp.get(folder, 0) + 1
+    problems = {
+        folder: {"image_count": len(names), "valid_count": ok_by_bp.get(folder, 0)}
+        for folder, names in bp_images.items()
+    }
+
+    entries.sort(key=lambda e: e["source"])
+    failures = [e for e in entries if not e["ok"]]
+    manifest = {
+        "canonical": {"format": "PNG", "mode": CANONICAL_MODE, "size": list(CANONICAL_SIZE)},
+        "statistics": {
+            "total_images": len(entries),
+            "valid_images": len(entries) - len(failures),
+            "failed_images": len(failures),
+            "removed_orphans": orphans,
+            "bp_count": len(problems),
+            "bp_with_12_valid": sum(1 for p in problems.values() if p["valid_count"] == 12)
+        },
+        "problems": problems,
+        "images": entries
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    stats = manifest["statistics"]
+    print("\n" + "=" * 40)
+    print("📊 原图校验 / 规范化报告")
+    print("-" * 40)
+    print(f"🖼️ 图片总数:        {stats['total_images']}")
+    print(f"✅ 有效图片:        {stats['valid_images']}")
+    print(f"❌ 失败图片:        {stats['failed_images']}")
+    print(f"🗑️ 删除过期输出:    {stats['removed_orphans']}")
+    print(f"📂 BP 数量:         {stats['bp_count']} (正好 12 张有效图: {stats['bp_with_12_valid']})")
+    for e in failures[:20]:
+        print(f"   ❌ {e['source']}: {e['error']}")
+    print("-" * 40)
+    print(f"💾 清单已保存至: {manifest_path}")
+    print("=" * 40 + "\n")
+    return manifest
+
+
+if __name__ == "__main__":
+    run_ingest()
@@ -0,0 +1,332 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+# ====================================================================
+# 轻量级埋点：计时 span、计数器、直方图，导出 JSONL / Prometheus 文本格式
+#
+# 环境变量 (不用改代码就能打开)：
+#   BONGARD_METRICS=metrics.jsonl   程序退出时导出指标 (.prom 结尾则导出 Prometheus 格式)
+#   BONGARD_PROFILE=cprofile        整个进程跑 cProfile，退出时写 bongard_profile.prof
+#   BONGARD_PROFILE=sample          采样线程定时抓主线程调用栈，退出时写 bongard_profile.folded (火焰图格式)
+#   BONGARD_SAMPLE_INTERVAL=0.005   采样间隔 (秒)
+# 子进程 (例如 pipeline.py 的进程池) 也会各自导出，文件名里加上 pid，不会互相覆盖：
+#   metrics.prom -> metrics.<pid>.prom，bongard_profile.prof -> bongard_profile.<pid>.prof
+#   (JSONL 是追加写，所有进程共用一个文件)
+#   fork 的进程池 (Linux 上默认) 要 close() + join() 正常收尾，子进程才会导出 (见 _on_exit)
+# ====================================================================
+METRICS_ENV = "BONGARD_METRICS"
+PROFILE_ENV = "BONGARD_PROFILE"
+SAMPLE_INTERVAL_ENV = "BONGARD_SAMPLE_INTERVAL"
+
+CPROFILE_OUTPUT = "bongard_profile.prof"
+SAMPLE_OUTPUT = "bongard_profile.folded"
+
+# 耗时直方图的桶 (秒)，覆盖从解码一张小图到一次 generate
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters = Counter()
+_histograms = {}
+_start_time = time.time()
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0,
+            "min": round(self.min, 6) if self.count else 0,
+            "max": round(self.max, 6),
+            "buckets": dict(zip([str(b) for b in self.buckets], self.bucket_counts))
+        }
+
+
+# ====================================================================
+# 记录接口
+# ====================================================================
+def incr(name, value=1, **labels):
+    """
+    计数器 +value，例如 incr("images_downloaded")
+    """
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name, value, **labels):
+    """
+    往直方图里记一个值，例如 observe("question_latency_seconds", 1.7)
+    """
+    with _lock:
+        k = _key(name, labels)
+        if k not in _histograms:
+            _histograms[k] = Histogram()
+        _histograms[k].observe(value)
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    给一段代码计时，耗时记到 <name>_seconds 直方图里：
+
+        with span("png_encode"):
+            combined_img.save(path)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+
+
+def timed(name):
+    """
+    span 的装饰器版本
+    """
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    当前所有指标 (可 JSON 序列化)
+    """
+    with _lock:
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": round(time.time() - _start_time, 3),
+            "script": os.path.basename(sys.argv[0]) if sys.argv else "",
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": v}
+                for (name, labels), v in sorted(_counters.items())
+            ],
+            "histograms": [
+                {"name": name, "labels": dict(labels), **h.to_dict()}
+                for (name, labels), h in sorted(_histograms.items())
+            ]
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# ====================================================================
+# 导出
+# ====================================================================
+def export_jsonl(path):
+    """
+    追加一行快照到 JSONL 文件 (多次运行的结果都保留，方便对比)
+    """
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(snapshot(), ensure_ascii=False) + "\n")
+
+
+def _prom_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def export_prometheus(path):
+    """
+    写成 Prometheus 文本格式 (node_exporter 的 textfile collector 可以直接读)
+    """
+    snap = snapshot()
+    lines = []
+    seen_types = set()
+
+    for c in snap["counters"]:
+        name = f"bongard_{c['name']}_total"
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} counter")
+            seen_types.add(name)
+        lines.append(f"{name}{_prom_labels(c['labels'])} {c['value']}")
+
+    for h in snap["histograms"]:
+        name = f"bongard_{h['name']}"
+        if name not in seen_types:
+            lines.append(f"# TYPE {name} histogram")
+            seen_types.add(name)
+        cumulative = 0
+        for bound, n in h["buckets"].items():
+            cumulative += n
+            lines.append(f"{name}_bucket{_prom_labels(h['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_bucket{_prom_labels(h['labels'], {'le': '+Inf'})} {h['count']}")
+        lines.append(f"{name}_sum{_prom_labels(h['labels'])} {h['sum']}")
+        lines.append(f"{name}_count{_prom_labels(h['labels'])} {h['count']}")
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def export(path):
+    if path.endswith(".prom"):
+        export_prometheus(path)
+    else:
+        export_jsonl(path)
+
+
+def print_summary():
+    """
+    在终端打印各 span 的耗时汇总，按总耗时排序
+    """
+    snap = snapshot()
+    rows = sorted(snap["histograms"], key=lambda h: h["sum"], reverse=True)
+    print("=" * 60)
+    print(f"{'指标':<32}{'次数':>8}{'总耗时(s)':>11}{'平均(ms)':>9}")
+    for h in rows:
+        print(f"{h['name']:<32}{h['count']:>8}{h['sum']:>11.3f}{h['mean'] * 1000:>9.2f}")
+    for c in snap["counters"]:
+        print(f"{c['name']:<32}{c['value']:>8}")
+    print("=" * 60)
+
+
+# ====================================================================
+# 可选的 profiler 钩子
+# ====================================================================
+class StackSampler:
+    """
+    采样式 profiler：后台线程每隔 interval 秒抓一次主线程调用栈，
+    统计成 collapsed stack 格式 (可直接喂给 flamegraph.pl / speedscope)
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._target = threading.main_thread().ident
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path=SAMPLE_OUTPUT):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+def _process_path(path):
+    """
+    主进程原样返回；子进程在扩展名前插入 pid
+    """
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def _reset_after_fork():
+    """
+    fork 出来的子进程会继承父进程已经记下的指标，清零后子进程只导出自己的
+    """
+    global _start_time
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    _start_time = time.time()
+
+
+_exit_hooks = []  # register_after_fork 只持有弱引用，这里留一份强引用
+
+
+def _on_exit(fn):
+    """
+    每个进程退出时调用一次 fn
+    atexit 只在正常退出的解释器里跑；fork 出来的 multiprocessing 子进程最后是 os._exit，
+    不跑 atexit，但会跑 multiprocessing 的 Finalize (进程池要 close + join 正常收尾，terminate 杀掉的就没办法了)
+    """
+    from multiprocessing import util
+    done = set()
+
+    def run():
+        if os.getpid() not in done:
+            done.add(os.getpid())
+            fn()
+    atexit.register(run)
+    util.Finalize(None, run, exitpriority=0)
+    # 子进程启动时 multiprocessing 会清空继承来的 Finalize，要在 fork 之后重新注册
+    _exit_hooks.append(run)
+    util.register_after_fork(run, lambda fn: util.Finalize(None, fn, exitpriority=0))
+
+
+def _install_from_env():
+    # 文件名在退出时才算：spawn 出来的子进程 import 本模块时还不知道自己是子进程
+    metrics_path = os.environ.get(METRICS_ENV)
+    if metrics_path:
+        def _export():
+            export(_process_path(metrics_path) if metrics_path.endswith(".prom") else metrics_path)
+        _on_exit(_export)
+
+    mode = os.environ.get(PROFILE_ENV, "").lower()
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def _dump():
+            profiler.disable()
+            profiler.dump_stats(_process_path(CPROFILE_OUTPUT))
+        _on_exit(_dump)
+    elif mode == "sample":
+        # 采样线程不会跟着 fork 到子进程里，所以只在本进程 (主进程 / spawn 子进程) 正常退出时写
+        sampler = StackSampler(float(os.environ.get(SAMPLE_INTERVAL_ENV, "0.005")))
+        sampler.start()
+        atexit.register(lambda: sampler.stop(_process_path(SAMPLE_OUTPUT)))
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+_install_from_env()
@@ -0,0 +1,300 @@
+import os
+import io
+import sys
+import glob
+import json
+import time
+import hashlib
+import tomllib
+from PIL import Image
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+SOURCE_ROOT = "Bongard_Dataset_v2_new_struct"
+TRAIN_DATA_DIR = "kohya_train_data/10_BongardStyle"
+# 默认用 traineddata/ 下最新的 LoRA 配置
+CONFIG_GLOB = os.path.join("traineddata", "config_lora-*.toml")
+MANIFEST_FILE = "latent_manifest.json"
+TODO_FILE = "latents_todo.txt"
+
+# Kohya 缓存 latent 的文件名后缀 (SDXL)：<图片名>_<宽4位>x<高4位>_sdxl.npz
+LATENT_SUFFIX = "_sdxl.npz"
+EXPORT_VERSION = 2
+
+
+def load_config(path=None):
+    if path is None:
+        candidates = sorted(glob.glob(CONFIG_GLOB))
+        if not candidates:
+            raise FileNotFoundError(f"找不到 Kohya 配置: {CONFIG_GLOB}")
+        path = candidates[-1]
+    with open(path, "rb") as f:
+        cfg = tomllib.load(f)
+    print(f"⚙️ 使用配置: {path}")
+    return cfg
+
+
+def bucket_settings(cfg):
+    res = [int(v) for v in str(cfg.get("resolution", "512,512")).split(",")]
+    width, height = res[0], res[-1]
+    return {
+        "max_area": width * height,
+        "reso_steps": int(cfg.get("bucket_reso_steps", 64)),
+        "min_reso": int(cfg.get("min_bucket_reso", 256)),
+        "max_reso": int(cfg.get("max_bucket_reso", 1024)),
+        "no_upscale": bool(cfg.get("bucket_no_upscale", False)),
+        "enable_bucket": bool(cfg.get("enable_bucket", False)),
+        "resolution": (width, height),
+        "caption_extension": cfg.get("caption_extension", ".caption"),
+    }
+
+
+def make_bucket_resolutions(b):
+    """
+    Kohya (sd-scripts) 的预定义 bucket 列表：面积不超过 max_area，宽高是 reso_steps 的倍数
+    """
+    steps = b["reso_steps"]
+    resos = set()
+    side = int(b["max_area"] ** 0.5 // steps) * steps
+    resos.add((side, side))
+    width = b["min_reso"]
+    while width <= b["max_reso"]:
+        height = min(b["max_reso"], int((b["max_area"] // width) // steps) * steps)
+        if height >= b["min_reso"]:
+            resos.add((width, height))
+            resos.add((height, width))
+        width += steps
+    return sorted(resos)
+
+
+def _round_to_steps(x, steps):
+    x = int(x + 0.5)
+    return x - x % steps
+
+
+def select_bucket(width, height, b):
+    """
+    按 Kohya 的 bucket 规则算出这张图会先缩放到多大、再裁成多大 -> (bucket, resized_size)：
+    - bucket_no_upscale：面积不超过 max_area 就不缩放 (永远不放大)，超过才等比缩小；
+      bucket = 缩放后尺寸向下取整到 reso_steps，多出来的部分居中裁掉
+    - 否则：在预定义 bucket 里选长宽比最接近的，等比缩放到刚好覆盖 bucket 再居中裁剪
+    """
+    steps = b["reso_steps"]
+    if not b["enable_bucket"]:
+        return b["resolution"], b["resolution"]
+
+    aspect = width / height
+    if b["no_upscale"]:
+        if width * height > b["max_area"]:
+            resized_width = (b["max_area"] * aspect) ** 0.5
+            resized_height = b["max_area"] / resized_width
+            bw_rounded = _round_to_steps(resized_width, steps)
+            bh_in_wr = _round_to_steps(bw_rounded / aspect, steps)
+            bh_rounded = _round_to_steps(resized_height, steps)
+            bw_in_hr = _round_to_steps(bh_rounded * aspect, steps)
+            if abs(bw_rounded / bh_in_wr - aspect) < abs(bw_in_hr / bh_rounded - aspect):
+                resized = (bw_rounded, int(bw_rounded / aspect + 0.5))
+            else:
+                resized = (int(bh_rounded * aspect + 0.5), bh_rounded)
+        else:
+            resized = (width, height)
+        bucket = (resized[0] - resized[0] % steps, resized[1] - resized[1] % steps)
+        return bucket, resized
+
+    resos = make_bucket_resolutions(b)
+    errors = [abs(w / h - aspect) for w, h in resos]
+    bucket = resos[errors.index(min(errors))]
+    scale = bucket[1] / height if aspect > bucket[0] / bucket[1] else bucket[0] / width
+    return bucket, (int(width * scale + 0.5), int(height * scale + 0.5))
+
+
+def resize_to_bucket(img, bucket, resized_size):
+    """
+    和 Kohya 训练时的处理一致，只是提前做好：先缩放到 resized_size (no_upscale 且不超面积时就是原尺寸)，
+    再把超出 bucket 的部分居中裁掉
+    Kohya 缩小用 cv2.INTER_AREA (这里用效果最接近的 Image.BOX)，放大用 LANCZOS
+    """
+    if resized_size != img.size:
+        shrink = resized_size[0] <= img.width and resized_size[1] <= img.height
+        img = img.resize(resized_size, Image.BOX if shrink else Image.LANCZOS)
+    bw, bh = bucket
+    left = (img.width - bw) // 2
+    top = (img.height - bh) // 2
+    return img.crop((left, top, left + bw, top + bh))
+
+
+def export_settings(b):
+    """
+    影响导出图片的设置 + 导出算法版本 (2: 改成和 Kohya 一样 no_upscale 时只裁剪不缩放)，变了就重新导出
+    """
+    return [b["max_area"], b["reso_steps"], b["no_upscale"], b["min_reso"], b["max_reso"], EXPORT_VERSION]
+
+
+def sha256_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def latent_name(base_name, size):
+    return f"{base_name}_{size[0]:04d}x{size[1]:04d}{LATENT_SUFFIX}"
+
+
+def load_manifest(train_dir):
+    path = os.path.join(train_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"images": {}}
+
+
+def save_manifest(train_dir, manifest):
+    with open(os.path.join(train_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+
+def refresh_latent_state(train_dir, base_name, entry):
+    """
+    latent 状态：
+    - fresh:   npz 存在，且记录的 latent 对应的图片哈希 == 当前图片哈希
+    - stale:   npz 存在，但图片已经变了 (包括磁盘上的图片被别的脚本覆盖，和清单记录的不一样)
+    - missing: 还没有 npz
+    Kohya 生成 npz 之后，第一次看到它时把磁盘上图片的哈希记为 latent 的来源
+    """
+    latent_path = os.path.join(train_dir, entry["latent_file"])
+    img_path = os.path.join(train_dir, f"{base_name}.png")
+    disk_sha = sha256_file(img_path) if os.path.exists(img_path) else None
+    if not os.path.exists(latent_path):
+        entry["latent_image_sha256"] = None
+        entry["latent_state"] = "missing"
+        return entry["latent_state"]
+    if entry.get("latent_image_sha256") is None and disk_sha is not None:
+        entry["latent_image_sha256"] = disk_sha
+    if disk_sha == entry["image_sha256"] and entry["latent_image_sha256"] == entry["image_sha256"]:
+        entry["latent_state"] = "fresh"
+    else:
+        entry["latent_state"] = "stale"
+    return entry["latent_state"]
+
+
+def export_training_data(source_root=SOURCE_ROOT, train_dir=TRAIN_DATA_DIR, config_path=None):
+    cfg = load_config(config_path)
+    b = bucket_settings(cfg)
+    caption_ext = b["caption_extension"]
+    os.makedirs(train_dir, exist_ok=True)
+
+    manifest = load_manifest(train_dir)
+    entries = manifest["images"]
+    counts = {"exported": 0, "unchanged": 0, "stale_latents_removed": 0}
+
+    folders = sorted(d for d in os.listdir(source_root) if os.path.isdir(os.path.join(source_root, d)))
+    for folder in folders:
+        img_src = os.path.join(source_root, folder, "combined.png")
+        txt_src = os.path.join(source_root, folder, "solution.txt")
+        if not (os.path.exists(img_src) and os.path.exists(txt_src)):
+            continue
+
+        base_name = f"{folder}_combined"
+        img_dst = os.path.join(train_dir, f"{base_name}.png")
+        txt_dst = os.path.join(train_dir, f"{base_name}{caption_ext}")
+
+        source_sha = sha256_file(img_src)
+        with open(txt_src, "r", encoding="utf-8") as f:
+            caption = f.read().strip()
+        caption_sha = hashlib.sha256(caption.encode("utf-8")).hexdigest()
+
+        old = entries.get(base_name)
+        # 不只看清单：磁盘上的图片可能被 traindata.py 之类的脚本覆盖过，要和清单里的哈希对一下
+        disk_sha = sha256_file(img_dst) if os.path.exists(img_dst) else None
+        if old and old["source_sha256"] == source_sha and disk_sha == old["image_sha256"] and old.get("bucket_settings") == export_settings(b):
+            counts["unchanged"] += 1
+            entry = old
+        else:
+            # 1. 缩放/裁剪到 bucket 尺寸，Kohya 读进来就不用再动
+            with Image.open(img_src) as img:
+                bucket, resized_size = select_bucket(img.width, img.height, b)
+                out = resize_to_bucket(img.convert("RGB"), bucket, resized_size)
+            buf = io.BytesIO()
+            out.save(buf, "PNG")
+            data = buf.getvalue()
+            image_sha = hashlib.sha256(data).hexdigest()
+
+            # 2. 图片内容变了，或者磁盘上的图片被覆盖过、latent 可能是从覆盖后的图片编码的：
+            #    旧 latent 作废，删掉让 Kohya 重新编码
+            latent_ok = bool(old) and old["image_sha256"] == image_sha and (
+                disk_sha in (None, image_sha) or old.get("latent_image_sha256") == image_sha)
+            if old and not latent_ok:
+                old_latent = os.path.join(train_dir, old["latent_file"])
+                if os.path.exists(old_latent):
+                    os.remove(old_latent)
+                    counts["stale_latents_removed"] += 1
+
+            with open(img_dst, "wb") as f:
+                f.write(data)
+            entry = {
+                "source": img_src,
+                "source_sha256": source_sha,
+                "image_sha256": image_sha,
+                "bucket": list(bucket),
+                "resized_size": list(resized_size),
+                "bucket_settings": export_settings(b),
+                "latent_file": latent_name(base_name, bucket),
+                "latent_image_sha256": old.get("latent_image_sha256") if latent_ok else None,
+                "exported_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+            counts["exported"] += 1
+
+        # 3. caption 用配置里的扩展名 (Kohya 配置是 .txt)
+        if entry.get("caption_sha256") != caption_sha or not os.path.exists(txt_dst):
+            with open(txt_dst, "w", encoding="utf-8") as f:
+                f.write(caption)
+            entry["caption_sha256"] = caption_sha
+
+        entries[base_name] = entry
+
+    manifest["caption_extension"] = caption_ext
+    report = check_latents(train_dir, manifest)
+    save_manifest(train_dir, manifest)
+
+    print("\n" + "=" * 40)
+    print("📦 Kohya 训练数据导出报告")
+    print("-" * 40)
+    print(f"🖼️ 新导出/更新图片:   {counts['exported']}")
+    print(f"♻️ 未变化跳过:        {counts['unchanged']}")
+    print(f"🗑️ 删除过期 latent:   {counts['stale_latents_removed']}")
+    print(f"🧊 latent 有效/过期/缺失: {report['fresh']}/{report['stale']}/{report['missing']}")
+    print(f"📝 caption 扩展名:     {caption_ext}")
+    print("=" * 40 + "\n")
+    return manifest
+
+
+def check_latents(train_dir=TRAIN_DATA_DIR, manifest=None):
+    """
+    检查每张图的 latent 状态，把需要 (重新) 编码的图片列到 latents_todo.txt，方便批量预计算
+    """
+    if manifest is None:
+        manifest = load_manifest(train_dir)
+    report = {"fresh": 0, "stale": 0, "missing": 0}
+    todo = []
+    for base_name, entry in sorted(manifest["images"].items()):
+        state = refresh_latent_state(train_dir, base_name, entry)
+        report[state] += 1
+        if state != "fresh":
+            todo.append(os.path.abspath(os.path.join(train_dir, f"{base_name}.png")))
+
+    with open(os.path.join(train_dir, TODO_FILE), "w", encoding="utf-8") as f:
+        f.write("\n".join(todo) + ("\n" if todo else ""))
+    return report
+
+
+if __name__ == "__main__":
+    # python kohya_export.py          -> 导出 (按 Kohya bucket 规则裁剪/缩放 + 写 caption + 更新清单)
+    # python kohya_export.py check    -> 只检查 latent 是否过期/缺失
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        manifest = load_manifest(TRAIN_DATA_DIR)
+        report = check_latents(TRAIN_DATA_DIR, manifest)
+        save_manifest(TRAIN_DATA_DIR, manifest)
+        print(f"🧊 latent 有效 {report['fresh']} / 过期 {report['stale']} / 缺失 {report['missing']}")
+        print(f"📝 需要编码的图片已写入: {os.path.join(TRAIN_DATA_DIR, TODO_FILE)}")
+    else:
+        export_training_data()
@@ -1,7 +1,19 @@
 import os
+import sys
 import json
 import re
 import random
+import numpy as np
+from instrumentation import incr
+from shape_features import build_feature_cache
+
+# 干扰项难度：按 "和答案图的特征距离" 把对侧 6 张图从近到远排好，从第 start 张开始取 3 张
+# random 为原来的随机抽取 (随机数调用顺序不变，生成的题目和以前完全一样)
+DIFFICULTY_TIERS = {
+    "hard": 0,     # 最像答案的 3 张
+    "medium": 1,
+    "easy": 3,     # 最不像答案的 3 张
+}
 
 # 设置随机种子，确保每次运行生成的题目顺序和选项一致（方便实验复现）
 random.seed(42)
@@ -12,7 +24,36 @@ def natural_sort_key(s):
     """
     return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', s)]
 
-def build_dual_mcq_dataset(dataset_path, output_json):
+def rank_opposite_images(dataset_path, bps):
+    """
+    一次性给所有 BP 算 左6 x 右6 的特征距离矩阵 (B, 6, 6)，不逐题循环
+    返回 (rank_for_left, rank_for_right)，形状都是 (B, 6, 6)：
+    rank_for_left[b, i] = 右侧 6 张图按和左图 i 的距离从近到远的下标，rank_for_right 同理
+    特征用 shape_features.npz 缓存 (增量更新，图片没变就不重算)
+    """
+    cache = build_feature_cache(dataset_path)
+    row = {k: i for i, k in enumerate(cache["keys"].tolist())}
+    feats, valid = cache["features"], cache["valid"]
+    mu, sigma = feats[valid].mean(axis=0), feats[valid].std(axis=0) + 1e-6
+    z = np.vstack([(feats - mu) / sigma, np.zeros((1, feats.shape[1]), dtype=np.float32)])
+    ok = np.append(valid, False)
+
+    # 缓存里没有 / 解码失败的图片指到最后一行 (全零)，距离记为无穷远，排到最后
+    missing = len(feats)
+    idx = np.array([[row.get(f"{bp['folder']}/{img}", missing) for img in bp["left"] + bp["right"]] for bp in bps])
+    vecs, good = z[idx], ok[idx]                                        # (B, 12, F), (B, 12)
+    left, right = vecs[:, :6], vecs[:, 6:]
+    dist = np.sqrt(((left[:, :, None, :] - right[:, None, :, :]) ** 2).sum(axis=3))  # (B, 6, 6)
+    dist[~(good[:, :6, None] & good[:, None, 6:])] = np.inf
+
+    return np.argsort(dist, axis=2, kind="stable"), np.argsort(dist.transpose(0, 2, 1), axis=2, kind="stable")
+
+def build_dual_mcq_dataset(dataset_path, output_json, difficulty="random"):
+    """
+    difficulty: "random" 随机抽干扰项；或 DIFFICULTY_TIERS 里的难度，按特征相似度挑对侧图片做干扰项
+    """
+    if difficulty != "random" and difficulty not in DIFFICULTY_TIERS:
+        raise ValueError(f"未知难度: {difficulty} (可选: random, {', '.join(DIFFICULTY_TIERS)})")
     all_questions = []
     
     # 统计项
@@ -32,6 +73,7 @@ def build_dual_mcq_dataset(dataset_path, output_json):
     stats["total_folders_scanned"] = len(folders)
     
     print(f"开始扫描目录: {dataset_path} ...\n")
+    bps = []
 
     for folder in folders:
         folder_path = os.path.join(dataset_path, folder)
@@ -67,12 +109,26 @@ def build_dual_mcq_dataset(dataset_path, output_json):
             except:
                 pass
 
+        bps.append({"folder": folder, "left": left_images, "right": right_images, "l_rule": l_rule, "r_rule": r_rule})
+
+    # 按相似度挑干扰项时，先把所有 BP 的距离排序一次算好
+    if difficulty != "random" and bps:
+        rank_l, rank_r = rank_opposite_images(dataset_path, bps)
+        start = DIFFICULTY_TIERS[difficulty]
+
+    for b, bp in enumerate(bps):
+        folder, left_images, right_images = bp["folder"], bp["left"], bp["right"]
+        l_rule, r_rule = bp["l_rule"], bp["r_rule"]
+
         # --- 任务 A: 考察左侧规则 (Positive Task) ---
         # 选一张左图作为答案，其余5张左图作为Context，3张右图作为干扰项
         ans_idx_l = random.randint(0, 5)
         correct_img_l = left_images[ans_idx_l]
         context_l = [img for i, img in enumerate(left_images) if i != ans_idx_l]
-        distractors_l = random.sample(right_images, 3)
+        if difficulty == "random":
+            distractors_l = random.sample(right_images, 3)
+        else:
+            distractors_l = [right_images[j] for j in rank_l[b, ans_idx_l, start:start + 3]]
         
         options_l = [correct_img_l] + distractors_l
         random.shuffle(options_l)
@@ -93,7 +149,10 @@ def build_dual_mcq_dataset(dataset_path, output_json):
         ans_idx_r = random.randint(0, 5)
         correct_img_r = right_images[ans_idx_r]
         context_r = [img for i, img in enumerate(right_images) if i != ans_idx_r]
-        distractors_r = random.sample(left_images, 3)
+        if difficulty == "random":
+            distractors_r = random.sample(left_images, 3)
+        else:
+            distractors_r = [left_images[j] for j in rank_r[b, ans_idx_r, start:start + 3]]
         
         options_r = [correct_img_r] + distractors_r
         random.shuffle(options_r)
@@ -109,16 +168,25 @@ def build_dual_mcq_dataset(dataset_path, output_json):
             "correct_image": correct_img_r
         }
 
+        if difficulty != "random":
+            q_pos["difficulty"] = q_neg["difficulty"] = difficulty
+
         all_questions.append(q_pos)
         all_questions.append(q_neg)
         stats["total_questions_generated"] += 2
 
+    # 统计项同时记到埋点计数器里 (可以导出成 JSONL / Prometheus)
+    for key, value in stats.items():
+        incr(f"mcq_{key}", value)
+
     # 5. 保存结果
     final_output = {
         "dataset_info": "Bongard Dual-Task MCQ Dataset",
         "statistics": stats,
         "questions": all_questions
     }
+    if difficulty != "random":
+        final_output["distractor_difficulty"] = difficulty
     
     with open(output_json, 'w', encoding='utf-8') as f:
         json.dump(final_output, f, indent=4, ensure_ascii=False)
@@ -131,6 +199,7 @@ def build_dual_mcq_dataset(dataset_path, output_json):
     print(f"✅ 合规 BP 数量:    {stats['valid_bp_count']}")
     print(f"⚠️ 跳过无效文件夹:  {stats['skipped_folders_count']}")
     print(f"📝 生成题目总数:    {stats['total_questions_generated']} (1 BP -> 2 Tasks)")
+    print(f"🎯 干扰项难度:      {difficulty}")
     print("-" * 40)
     print(f"💾 结果已保存至: {output_json}")
     print("="*40 + "\n")
@@ -141,4 +210,8 @@ MY_DATASET_PATH = r"C:\Users\fypuser\Documents\fyp-Bongard-problem-\Bongard_Data
 OUTPUT_FILENAME = "bongard_v2_dual_tasks.json"
 
 if __name__ == "__main__":
-    build_dual_mcq_dataset(MY_DATASET_PATH, OUTPUT_FILENAME)
\ No newline at end of file
+    # python mutiple_choice_generate.py          -> 随机干扰项 (和以前一样)
+    # python mutiple_choice_generate.py hard     -> 按特征相似度挑干扰项 (hard / medium / easy)
+    level = sys.argv[1] if len(sys.argv) > 1 else "random"
+    output = OUTPUT_FILENAME if level == "random" else OUTPUT_FILENAME.replace(".json", f"_{level}.json")
+    build_dual_mcq_dataset(MY_DATASET_PATH, output, level)
\ No newline at end of file
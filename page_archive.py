@@ -0,0 +1,192 @@
+import os
+import json
+import zlib
+import time
+import struct
+import hashlib
+from threading import Lock
+
+# ====================================================================
+# 网页归档：所有抓到的页面压缩后追加到一个文件里，旁边一个偏移索引
+# ====================================================================
+# pages.archive：记录连续存放，每条 = uint32 头长度 | JSON 头 | uint32 数据长度 | zlib 压缩的 HTML
+# pages.archive.idx：每行一个 JSON {"key", "offset", "length", ...}，同一个 key 以最后一行为准
+# 索引丢了可以用 rebuild_index() 从归档文件本身扫一遍重建
+ARCHIVE_NAME = "pages.archive"
+INDEX_SUFFIX = ".idx"
+COMPRESS_LEVEL = 6
+_LEN = struct.Struct("<I")
+
+# 有 lxml 就直接用 lxml.html + XPath (不经过 bs4，每页 ~1ms)
+# 没有就退回 bs4 + html.parser，只解析需要的标签：<img> (例图)、<tr> (solution 所在的表格行)、
+# <a> (按文档顺序找第一个 BPxx 链接)，其他节点不建树。bs4 只在用到时才 import
+try:
+    import lxml.html
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+PAGE_TAGS = ["img", "tr", "a"]
+
+
+class PageArchive:
+    """
+    线程安全的追加写 (爬虫是多线程的)，读按偏移随机访问
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.lock = Lock()
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.index[entry["key"]] = entry
+        elif os.path.exists(path):
+            self.rebuild_index()
+
+    def append(self, key, content, **meta):
+        """
+        content 是原始字节 (r.content)；meta 例如 url / status，一起存进记录头
+        """
+        data = zlib.compress(content, COMPRESS_LEVEL)
+        header = json.dumps({
+            "key": key,
+            "sha1": hashlib.sha1(content).hexdigest(),
+            "raw_bytes": len(content),
+            "fetched_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **meta
+        }, ensure_ascii=False).encode("utf-8")
+        record = _LEN.pack(len(header)) + header + _LEN.pack(len(data)) + data
+
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(record)
+            entry = {**json.loads(header), "offset": offset, "length": len(record)}
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.index[key] = entry
+        return entry
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index)
+
+    def get(self, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        with open(self.path, "rb") as f:
+            return read_record(f, entry["offset"])[1]
+
+    def rebuild_index(self):
+        """
+        顺序扫描归档文件重建索引 (最后一条不完整的记录会被忽略)
+        """
+        self.index = {}
+        entries = []
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + _LEN.size <= size:
+                f.seek(offset)
+                (header_len,) = _LEN.unpack(f.read(_LEN.size))
+                header = f.read(header_len)
+                raw = f.read(_LEN.size)
+                if len(header) < header_len or len(raw) < _LEN.size:
+                    break
+                (data_len,) = _LEN.unpack(raw)
+                length = _LEN.size * 2 + header_len + data_len
+                if offset + length > size:
+                    break
+                entry = {**json.loads(header), "offset": offset, "length": length}
+                entries.append(entry)
+                self.index[entry["key"]] = entry
+                offset += length
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return len(self.index)
+
+
+def read_record(f, offset):
+    """
+    从已打开的归档文件里读一条记录 -> (头, 解压后的字节)
+    """
+    f.seek(offset)
+    (header_len,) = _LEN.unpack(f.read(_LEN.size))
+    header = json.loads(f.read(header_len))
+    (data_len,) = _LEN.unpack(f.read(_LEN.size))
+    return header, zlib.decompress(f.read(data_len))
+
+
+# ====================================================================
+# oebp.org 题目页解析 (爬虫在线解析和离线重新解析共用)
+# ====================================================================
+def parse_problem(html, bp_id):
+    """
+    从题目页面里提取 (例图 src 列表, solution 文字)
+    - 例图：src 里带 /examples/ 的 <img>
+    - solution：第一个 <a href="/BPxx">BPxx</a> 所在表格行的第 3 个单元格
+    """
+    if HTML_PARSER == "lxml":
+        try:
+            return _parse_problem_lxml(html, bp_id)
+        except (ValueError, lxml.etree.ParserError):
+            pass  # 空页面 / 带 XML 编码声明的字符串，交给 bs4
+
+    from bs4 import BeautifulSoup, SoupStrainer
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer(PAGE_TAGS))
+    img_srcs = [img["src"] for img in soup.find_all("img", src=lambda src: src and "/examples/" in src)]
+
+    solution_text = "No solution found"
+    link = soup.find("a", href=f"/BP{bp_id}", string=f"BP{bp_id}")
+    if link and link.find_parent("tr"):
+        tds = link.find_parent("tr").find_all("td")
+        if len(tds) >= 3: solution_text = tds[2].get_text(strip=True)
+    return img_srcs, solution_text
+
+
+def _parse_problem_lxml(html, bp_id):
+    """
+    和上面 bs4 版本结果一致 (get_text(strip=True) = 每段文字 strip 后直接拼接)
+    """
+    root = lxml.html.fromstring(html)
+    img_srcs = [str(src) for src in root.xpath("//img[contains(@src, '/examples/')]/@src")]
+
+    solution_text = "No solution found"
+    links = root.xpath(f"(//a[@href='/BP{bp_id}' and string()='BP{bp_id}'])[1]")
+    trs = links[0].xpath("ancestor::tr[1]") if links else []
+    if trs:
+        tds = trs[0].xpath(".//td")
+        if len(tds) >= 3: solution_text = "".join(s.strip() for s in tds[2].itertext())
+    return img_srcs, solution_text
+
+
+def parse_archive_chunk(args):
+    """
+    进程池任务：解析归档里的一批页面 (按偏移读，不需要整个索引)
+    """
+    archive_path, entries = args
+    results = {}
+    with open(archive_path, "rb") as f:
+        for entry in entries:
+            header, content = read_record(f, entry["offset"])
+            html = content.decode(header.get("encoding") or "utf-8", errors="replace")
+            img_srcs, solution_text = parse_problem(html, header["key"][2:])
+            results[header["key"]] = {
+                "solution": solution_text,
+                "image_count": len(img_srcs),
+                "image_srcs": img_srcs,
+                "fetched_at": header.get("fetched_at"),
+            }
+    return results
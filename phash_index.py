@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import re
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image
+import split
+from pipeline import load_script
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+# 要扫描的目录 -> 属于哪个集合 (train / eval)，用来检查训练集和评测集之间的泄漏
+# new_struct 是训练数据的来源 (traindata.py / kohya_export.py 把它的 combined.png 拷进 kohya_train_data)，
+# 评测只用 Bongard_Dataset_v2 里的小图
+# 训练集都是整张拼图，评测集都是单张小图：拼图先按布局切回 12 张小图再算哈希，泄漏在小图级别比较
+SOURCES = {
+    "Bongard_Dataset_v2": "eval",
+    "Bongard_Dataset_v2_new_struct": "train",
+    "Dataset for training/bongard_augmented_dataset": "train",
+    "kohya_train_data": "train",
+}
+INDEX_FILE = "phash_index.npz"
+REPORT_FILE = "phash_report.json"
+
+VALID_EXTS = (".png", ".gif", ".jpg", ".jpeg")
+HASH_SIZE = 8          # 8x8 = 64 bit
+DCT_SIZE = 32          # 先缩到 32x32 再做 DCT
+MAX_DISTANCE = 4       # 汉明距离 <= 4 视为近似重复
+ASPECT_TOLERANCE = 0.1 # 宽高比和标准拼图差这么多以内，当作 (按 bucket 缩放裁剪过的) 标准拼图
+BLANK_STD = 2.0        # 灰度标准差低于这个值的小图 (空白格) 不参与比较，否则所有空白格都连成一簇
+SPECIAL_COMBINER = "Combiner for special cases.py"
+NUM_WORKERS = os.cpu_count() or 4
+
+# 一个字节里 1 的个数，用来做向量化 popcount (numpy 没有 bitwise_count 时用)
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+DCT = _dct_matrix(DCT_SIZE)
+
+
+# ====================================================================
+# 计算哈希
+# ====================================================================
+_special_layout = None
+
+
+def grid_tile_boxes(width, height):
+    """
+    拼图里 12 张小图的裁剪框 [(left, top, right, bottom), ...]，不是拼图 (单张小图) 返回 None
+    - 标准 2x6 拼图 (split.py)：用 split.tile_position 算坐标；kohya_export.py 按 Kohya bucket 居中裁剪 (必要时先等比缩放) 过的
+      也按同样的变换换算
+    - 特殊情况拼图 (Combiner for special cases.py)：左边 300 像素是 12 张 60x60 小图，右边是文字区，文字区跳过
+    """
+    global _special_layout
+    gw, gh = split.IMG_AREA_WIDTH, split.IMG_AREA_HEIGHT
+    if abs(width / height - gw / gh) < ASPECT_TOLERANCE:
+        if width <= gw and height <= gh:
+            # bucket_no_upscale 且面积没超：只居中裁剪，不缩放
+            scale, ox, oy = 1, (gw - width) // 2, (gh - height) // 2
+        else:
+            scale = max(width / gw, height / gh)
+            ox, oy = (gw * scale - width) / 2, (gh * scale - height) / 2
+        size = split.SINGLE_IMG_SIZE
+        return [
+            (round(x * scale - ox), round(y * scale - oy), round((x + size) * scale - ox), round((y + size) * scale - oy))
+            for x, y in map(split.tile_position, range(2 * split.NUM_IMAGES_PER_GROUP))
+        ]
+
+    if _special_layout is None:
+        _special_layout = load_script("special_combiner", SPECIAL_COMBINER)
+    m = _special_layout
+    if width == m.IMG_AREA_WIDTH + m.TEXT_AREA_WIDTH:
+        boxes = []
+        per_group = m.SUB_GRID_ROWS * m.SUB_GRID_COLS
+        for i in range(2 * per_group):
+            offset_x = 0 if i < per_group else m.SINGLE_GROUP_WIDTH + m.GROUP_SPACING
+            idx = i % per_group
+            x = offset_x + m.IMG_PADDING + (idx % m.SUB_GRID_COLS) * (m.SINGLE_IMG_SIZE + m.IMG_PADDING)
+            y = m.IMG_PADDING + (idx // m.SUB_GRID_COLS) * (m.SINGLE_IMG_SIZE + m.IMG_PADDING)
+            boxes.append((x, y, x + m.SINGLE_IMG_SIZE, y + m.SINGLE_IMG_SIZE))
+        return boxes
+    return None
+
+
+def load_tiles(path):
+    """
+    读图 -> (每张小图的编号, (N, 32, 32) 灰度) (在子进程里跑)，失败返回 None
+    拼图切成 12 张，单张小图编号为 -1；空白格去掉
+    """
+    try:
+        with Image.open(path) as img:
+            gray = img.convert("L")
+    except Exception:
+        return None
+    boxes = grid_tile_boxes(*gray.size)
+    crops = [(-1, gray)] if boxes is None else [(i, gray.crop(box)) for i, box in enumerate(boxes)]
+    tiles, grays = [], []
+    for i, crop in crops:
+        g = np.asarray(crop.resize((DCT_SIZE, DCT_SIZE), Image.BILINEAR), dtype=np.float32)
+        if g.std() >= BLANK_STD:
+            tiles.append(i)
+            grays.append(g)
+    if not grays:
+        return np.zeros(0, dtype=np.int8), np.zeros((0, DCT_SIZE, DCT_SIZE), dtype=np.float32)
+    return np.array(tiles, dtype=np.int8), np.stack(grays)
+
+
+def phash_batch(grays):
+    """
+    一批 (N, 32, 32) 灰度图一次性算 pHash：
+    二维 DCT 用两次矩阵乘法，取左上角 8x8 低频，与中位数比较得到 64 bit，打包成 uint64
+    """
+    coeffs = np.einsum("ij,njk,lk->nil", DCT, grays, DCT)[:, :HASH_SIZE, :HASH_SIZE]
+    flat = coeffs.reshape(len(grays), -1)
+    bits = flat > np.median(flat[:, 1:], axis=1, keepdims=True)  # 中位数不算直流分量
+    return np.packbits(bits, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def popcount64(x):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.uint8)
+    return _POPCOUNT_TABLE[x.view(np.uint8).reshape(-1, 8)].sum(axis=1).astype(np.uint8)
+
+
+def scan_sources(sources=SOURCES):
+    paths, splits = [], []
+    for root, split_name in sources.items():
+        if not os.path.exists(root):
+            print(f"⚠ 找不到目录 {root}，跳过")
+            continue
+        for dirpath, _, files in os.walk(root):
+            for name in sorted(files):
+                if name.lower().endswith(VALID_EXTS):
+                    paths.append(os.path.join(dirpath, name))
+                    splits.append(split_name)
+    return paths, splits
+
+
+def build_index(sources=SOURCES, index_file=INDEX_FILE, num_workers=NUM_WORKERS):
+    """
+    扫描所有图片，切成小图算 pHash，结果存成 npz (每张小图一行：路径、小图编号、集合、哈希)
+    已有索引里 (路径, 大小, 修改时间) 没变的图片直接复用，不重新解码
+    """
+    paths, splits = scan_sources(sources)
+    stamps = np.array([f"{os.path.getsize(p)}:{os.path.getmtime(p):.0f}" for p in paths])
+
+    # 每张图片 -> (小图编号数组, 哈希数组)；None 表示无法解码
+    per_image = [None] * len(paths)
+    todo = list(range(len(paths)))
+
+    if os.path.exists(index_file):
+        old = load_index(index_file)
+        if "image_ok" in old:
+            rows = {}
+            for r, key in enumerate(zip(old["paths"], old["stamps"])):
+                rows.setdefault(key, []).append(r)
+            # 上次扫描过的图片：ok=True 但没有行的是全空白，ok=False 的是无法解码
+            scanned = dict(zip(zip(old["image_paths"], old["image_stamps"]), old["image_ok"]))
+            empty = (np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.uint64))
+            todo = []
+            for i, key in enumerate(zip(paths, stamps)):
+                if key not in scanned:
+                    todo.append(i)
+                elif scanned[key]:
+                    r = rows.get(key, [])
+                    per_image[i] = (old["tiles"][r], old["hashes"][r]) if r else empty
+
+    print(f"🔍 共 {len(paths)} 张图片，需要重新计算 {len(todo)} 张")
+    if todo:
+        with Pool(num_workers) as pool:
+            loaded = pool.map(load_tiles, [paths[i] for i in todo], chunksize=64)
+            pool.close()  # 正常收尾 (不被 terminate)，子进程的埋点才会导出
+            pool.join()
+        stacks = [t[1] for t in loaded if t is not None]
+        total = sum(len(g) for g in stacks)
+        all_hashes = phash_batch(np.concatenate(stacks)) if total else np.zeros(0, dtype=np.uint64)
+        pos = 0
+        for i, t in zip(todo, loaded):
+            if t is not None:
+                per_image[i] = (t[0], all_hashes[pos:pos + len(t[0])])
+                pos += len(t[0])
+
+    row_paths, row_tiles, row_splits, row_stamps, row_hashes = [], [], [], [], []
+    failed = [i for i, t in enumerate(per_image) if t is None]
+    for i, t in enumerate(per_image):
+        if t is None:
+            continue
+        n = len(t[0])
+        row_paths += [paths[i]] * n
+        row_splits += [splits[i]] * n
+        row_stamps += [stamps[i]] * n
+        row_tiles.append(np.asarray(t[0], dtype=np.int8))
+        row_hashes.append(np.asarray(t[1], dtype=np.uint64))
+
+    np.savez(
+        index_file,
+        paths=np.array(row_paths, dtype=str), tiles=np.concatenate(row_tiles) if row_tiles else np.zeros(0, np.int8),
+        splits=np.array(row_splits, dtype=str), stamps=np.array(row_stamps, dtype=str),
+        hashes=np.concatenate(row_hashes) if row_hashes else np.zeros(0, np.uint64),
+        image_paths=np.array(paths, dtype=str), image_stamps=stamps,
+        image_ok=np.array([t is not None for t in per_image], dtype=bool),
+    )
+    print(f"💾 索引已保存至: {index_file} ({len(row_paths)} 张小图，{len(failed)} 张图片无法解码)")
+    return load_index(index_file)
+
+
+def load_index(index_file=INDEX_FILE):
+    data = np.load(index_file)
+    return {k: data[k] for k in data.files}
+
+
+# ====================================================================
+# 向量化近邻搜索 (multi-index hashing)
+# ====================================================================
+def _chunk_bounds(max_distance):
+    """
+    抽屉原理：把 64 bit 切成 max_distance+1 段，距离 <= max_distance 的两个哈希至少有一段完全相同
+    """
+    m = max_distance + 1
+    edges = np.linspace(0, 64, m + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _pairs_within_groups(keys):
+    """
+    keys 相同的元素两两配对 (全向量化，不写 Python 双重循环)
+    返回 (i, j) 两个数组，i < j 为原始下标
+    """
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    group_end = np.repeat(starts + sizes, sizes)
+
+    pos = np.arange(len(keys))
+    partners = group_end - pos - 1
+    left = np.repeat(pos, partners)
+    offsets = np.arange(partners.sum()) - np.repeat(np.cumsum(partners) - partners, partners)
+    right = left + 1 + offsets
+
+    a, b = order[left], order[right]
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+def find_near_duplicate_pairs(hashes, max_distance=MAX_DISTANCE):
+    """
+    找出所有汉明距离 <= max_distance 的图片，返回聚类用的边 (i, j) 和近似重复对的数量
+    1. 先按完全相同的哈希折叠 (大量复制出来的图不会让候选对爆炸)
+    2. 对去重后的哈希做 multi-index hashing，按段分桶生成候选对
+    3. 候选对用 XOR + popcount 向量化验证
+    """
+    uniq, inverse, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+
+    # 每段分桶得到候选对，先就地验证距离 (候选对很多，但通过的很少)，最后只对通过的去重
+    hits = []
+    for lo, hi in _chunk_bounds(max_distance):
+        width = hi - lo
+        keys = (uniq >> np.uint64(64 - hi)) & np.uint64((1 << width) - 1)
+        i, j = _pairs_within_groups(keys)
+        keep = popcount64(uniq[i] ^ uniq[j]) <= max_distance
+        hits.append(i[keep].astype(np.int64) * len(uniq) + j[keep])
+
+    pair_keys = np.unique(np.concatenate(hits))
+    ui, uj = pair_keys // len(uniq), pair_keys % len(uniq)
+
+    # 每个唯一哈希取一个代表：同哈希的图片连到代表上 (星形边)，近邻边只连代表之间
+    order = np.argsort(inverse, kind="stable")
+    rep = order[np.searchsorted(inverse[order], np.arange(len(uniq)))]
+    members = np.arange(len(hashes))
+    not_rep = members != rep[inverse]
+
+    pi = np.concatenate([rep[inverse[not_rep]], rep[ui]])
+    pj = np.concatenate([members[not_rep], rep[uj]])
+
+    # 实际的图片对数量按组合数算，不用真的展开
+    c = counts.astype(np.int64)
+    num_exact = int((c * (c - 1) // 2).sum())
+    num_near = int((c[ui] * c[uj]).sum())
+    return pi, pj, num_exact, num_near
+
+
+def cluster_pairs(n, pi, pj):
+    """
+    连通分量 (向量化标签传播)：每轮把每条边两端的标签取最小，直到不再变化
+    """
+    labels = np.arange(n)
+    while len(pi):
+        low = np.minimum(labels[pi], labels[pj])
+        new = labels.copy()
+        np.minimum.at(new, pi, low)
+        np.minimum.at(new, pj, low)
+        new = new[new]  # 指针跳跃，加速收敛
+        if np.array_equal(new, labels):
+            break
+        labels = new
+    return labels
+
+
+def query(index, path, max_distance=MAX_DISTANCE):
+    """
+    查询一张图片 (拼图则逐张小图) 的近似重复 (整表 XOR + popcount，一次向量运算)
+    返回 [(本图小图编号, 命中路径, 命中小图编号, 距离), ...]
+    """
+    loaded = load_tiles(path)
+    if loaded is None or not len(loaded[0]):
+        return []
+    results = []
+    for tile, h in zip(loaded[0].tolist(), phash_batch(loaded[1])):
+        dist = popcount64(index["hashes"] ^ h)
+        hits = np.flatnonzero(dist <= max_distance)
+        hits = hits[np.argsort(dist[hits], kind="stable")]
+        results += [(tile, str(index["paths"][i]), int(index["tiles"][i]), int(dist[i])) for i in hits]
+    return results
+
+
+def bp_of(path):
+    """
+    从路径里取 BP 编号 (.../BP123/..., BP123_c1.png, BP123_combined.png)
+    """
+    m = re.search(r"BP(\d+)", path)
+    return f"BP{m.group(1)}" if m else None
+
+
+def build_report(index, max_distance=MAX_DISTANCE, report_file=REPORT_FILE):
+    start = time.perf_counter()
+    hashes = index["hashes"]
+    paths = index["paths"]
+    tiles = index["tiles"]
+    splits = index["splits"]
+
+    pi, pj, num_exact, num_near = find_near_duplicate_pairs(hashes, max_distance)
+    labels = cluster_pairs(len(hashes), pi, pj)
+
+    # 聚类：只保留大小 >= 2 的簇
+    uniq_labels, cluster_ids, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    multi = np.flatnonzero(sizes >= 2)
+    order = np.argsort(cluster_ids, kind="stable")
+    bounds = np.r_[0, np.cumsum(sizes)]
+
+    clusters, leaks = [], []
+    leaking_bps = set()
+    for c in multi[np.argsort(-sizes[multi], kind="stable")]:
+        members = order[bounds[c]:bounds[c + 1]]
+        member_splits = set(splits[members].tolist())
+        entry = {
+            "size": int(sizes[c]),
+            "splits": sorted(member_splits),
+            # 拼图里的小图写成 "路径#编号"
+            "paths": [p if t < 0 else f"{p}#{t}" for p, t in zip(paths[members].tolist(), tiles[members].tolist())]
+        }
+        clusters.append(entry)
+        if len(member_splits) > 1:
+            leaks.append(entry)
+            leaking_bps.update(b for b in map(bp_of, paths[members].tolist()) if b)
+
+    elapsed = time.perf_counter() - start
+    report = {
+        "num_images": int(len(np.unique(paths))),
+        "num_tiles": int(len(hashes)),
+        "max_distance": max_distance,
+        "num_near_duplicate_pairs": num_exact + num_near,
+        "num_exact_duplicate_pairs": num_exact,
+        "num_clusters": len(clusters),
+        "num_images_in_clusters": int(sum(c["size"] for c in clusters)),
+        "num_leaking_clusters": len(leaks),
+        "num_leaking_bps": len(leaking_bps),
+        "leaking_bps": sorted(leaking_bps, key=lambda b: int(b[2:])),
+        "search_seconds": round(elapsed, 3),
+        "leaking_clusters": leaks,
+        "clusters": clusters
+    }
+    with open(report_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("=" * 40)
+    print(f"📊 感知哈希去重报告")
+    print(f"🖼️ 图片总数:          {report['num_images']} (切成 {report['num_tiles']} 张小图)")
+    print(f"🔗 近似重复对:        {report['num_near_duplicate_pairs']} (完全相同 {report['num_exact_duplicate_pairs']})")
+    print(f"🧩 重复簇数量:        {report['num_clusters']} (涉及 {report['num_images_in_clusters']} 张)")
+    print(f"🚨 train/eval 泄漏簇: {report['num_leaking_clusters']} (涉及 {report['num_leaking_bps']} 个 BP)")
+    print(f"⏱️ 搜索耗时:          {elapsed:.3f}s")
+    print(f"💾 报告已保存至: {report_file}")
+    print("=" * 40)
+    return report
+
+
+if __name__ == "__main__":
+    # python phash_index.py                 -> 建索引 + 出报告
+    # python phash_index.py query some.png  -> 查某张图的近似重复
+    if len(sys.argv) > 2 and sys.argv[1] == "query":
+        index = load_index() if os.path.exists(INDEX_FILE) else build_index()
+        for tile, p, hit_tile, d in query(index, sys.argv[2]):
+            print(f"#{tile:<3} {d:>2}  {p}" + (f"#{hit_tile}" if hit_tile >= 0 else ""))
+    else:
+        index = build_index()
+        build_report(index)
@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import time
+import random
+import glob
+import hashlib
+import argparse
+import multiprocessing
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# 注意：这里只 import 标准库。PIL / bs4 / numpy / torch 都在各阶段函数里用到时才导入，
+# 所以 `python pipeline.py list` 这种命令是秒开的，进程池的子进程也不会多加载东西
+
+# ====================================================================
+# --- 共享配置 (所有脚本共用一份路径/参数) ---
+# ====================================================================
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = "pipeline.toml"     # 可选，存在就覆盖下面的默认值 (平铺的 key = value)
+CACHE_FILE = ".pipeline_cache.json"
+KOHYA_CONFIG_GLOB = os.path.join("traineddata", "config_lora-*.toml")
+
+DEFAULT_CONFIG = {
+    "raw_dir": "Bongard_Dataset_v2",
+    "report_file": os.path.join("Bongard_Dataset_v2", "patterns_report.txt"),
+    "sorted_report": "patterns_report.txt",
+    "struct_dir": "Bongard_Dataset_v2_new_struct",
+    "augment_dir": "bongard_augmented_dataset_v3",
+    "train_dir": "kohya_train_data/10_BongardStyle",
+    "kohya_config": "",             # 空 = traineddata/ 下最新的 config_lora-*.toml (和 kohya_export.py 一样)
+    "mcq_json": "bongard_v2_dual_tasks.json",
+    "refined_json": "bongard_v2_refined_rules.json",
+    "mcq_difficulty": "random",
+    "crawl_start": 1,
+    "crawl_end": 5000,
+    "crawl_target": 1000,
+    "model_path": r"D:\qwenVL\Qwen3-VL-8B-Instruct",
+    "prompt_mode": "multi",
+    "decode_mode": "generate",
+    "workers": os.cpu_count() or 4,
+}
+
+
+def load_config(path=CONFIG_FILE, overrides=()):
+    """
+    默认值 <- pipeline.toml <- 命令行 --set key=value
+    """
+    cfg = dict(DEFAULT_CONFIG)
+    if os.path.exists(path):
+        import tomllib
+        with open(path, "rb") as f:
+            cfg.update(tomllib.load(f))
+    for item in overrides:
+        key, _, value = item.partition("=")
+        if key not in DEFAULT_CONFIG:
+            raise KeyError(f"未知配置项: {key}")
+        cfg[key] = type(DEFAULT_CONFIG[key])(value)
+    if not cfg["kohya_config"]:
+        candidates = sorted(glob.glob(KOHYA_CONFIG_GLOB))
+        cfg["kohya_config"] = candidates[-1] if candidates else KOHYA_CONFIG_GLOB
+    return cfg
+
+
+def load_script(name, filename):
+    """
+    按文件路径导入仓库里的脚本 (有些文件名带空格/连字符，不能直接 import)
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ====================================================================
+# 进程池里跑的单个 BP 任务 (必须是模块顶层函数，Windows 的 spawn 才能 pickle)
+# ====================================================================
+_special_module = None
+
+
+def _compose_bp(args):
+    import split
+    source_dir, target_dir, bp_id = args
+    split.SOURCE_DIR, split.TARGET_DIR = source_dir, target_dir
+    split.process_to_new_struct(bp_id)
+
+
+def _augment_bp(args):
+    global _special_module
+    source_dir, target_dir, bp_id = args
+    if _special_module is None:
+        _special_module = load_script("split_special", "split for special case.py")
+    special = _special_module
+    special.SOURCE_DIR, special.TARGET_DIR = source_dir, target_dir
+    special.process_special_bp(bp_id)
+
+
+def _bp_numbers(root):
+    return sorted(int(d[2:]) for d in os.listdir(root)
+                  if d.startswith("BP") and d[2:].isdigit() and os.path.isdir(os.path.join(root, d)))
+
+
+# ====================================================================
+# 各阶段：fn(cfg, pool) -> 处理的条目数
+# ====================================================================
+def stage_crawl(cfg, pool):
+    scraper = load_script("bp_scraper", "Bongrad-problem scraper.py")
+    scraper.OUTPUT_DIR = cfg["raw_dir"]
+    scraper.SOLUTION_FILE = os.path.join(cfg["raw_dir"], "solutions_and_images.csv")
+    scraper.REPORT_FILE = cfg["report_file"]
+    return scraper.crawl(cfg["crawl_start"], cfg["crawl_end"], cfg["crawl_target"])
+
+
+def stage_sort_report(cfg, pool):
+    import sort
+    sort.sort_report(cfg["report_file"], cfg["sorted_report"])
+    return 1
+
+
+def stage_compose(cfg, pool):
+    os.makedirs(cfg["struct_dir"], exist_ok=True)
+    jobs = [(cfg["raw_dir"], cfg["struct_dir"], bp) for bp in _bp_numbers(cfg["raw_dir"])]
+    list(pool.map(_compose_bp, jobs, chunksize=16))
+    return len(jobs)
+
+
+def stage_augment(cfg, pool):
+    special = load_script("split_special", "split for special case.py")
+    os.makedirs(cfg["augment_dir"], exist_ok=True)
+    special_list = special.RIGHT_7 + special.LEFT_7 + special.LEFT_8 + special.BOTH_7 + special.RIGHT_8
+    jobs = [(cfg["raw_dir"], cfg["augment_dir"], bp) for bp in sorted(special_list)]
+    list(pool.map(_augment_bp, jobs))
+    return len(jobs)
+
+
+def stage_kohya(cfg, pool):
+    import kohya_export
+    # 按 bucket 预缩放 + latent 清单 (traindata.py 只是原样复制，会覆盖掉缩放好的图片)
+    manifest = kohya_export.export_training_data(cfg["struct_dir"], cfg["train_dir"], cfg["kohya_config"])
+    return len(manifest["images"])
+
+
+def stage_mcq(cfg, pool):
+    import mutiple_choice_generate
+    # 和单独运行脚本时一样从种子 42 开始，生成的题目完全一致
+    random.seed(42)
+    mutiple_choice_generate.build_dual_mcq_dataset(cfg["raw_dir"], cfg["mcq_json"], cfg["mcq_difficulty"])
+    return 1
+
+
+def stage_rules(cfg, pool):
+    import update_rules
+    update_rules.update_bongard_rules(cfg["mcq_json"], cfg["refined_json"])
+    return 1
+
+
+def stage_evaluate(cfg, pool):
+    import test_qwen_vl
+    test_qwen_vl.MODEL_PATH = cfg["model_path"]
+    test_qwen_vl.DATASET_ROOT = os.path.abspath(cfg["raw_dir"])
+    test_qwen_vl.JSON_PATH = cfg["refined_json"]
+    test_qwen_vl.run_evaluation(cfg["prompt_mode"], cfg["decode_mode"])
+    return 1
+
+
+# ====================================================================
+# 阶段 DAG (声明式)
+# ====================================================================
+# inputs / outputs / params 都是配置里的 key；依赖关系由 "谁的输出是谁的输入" 自动推出
+# scripts 里的源码变了，阶段缓存也会失效
+# default=False 的阶段 (联网爬虫、GPU 推理) 不会被 rebuild 自动带上，要显式点名
+STAGES = {
+    "crawl": {"fn": stage_crawl, "inputs": [], "outputs": ["raw_dir", "report_file"],
+              "params": ["crawl_start", "crawl_end", "crawl_target"],
+              "scripts": ["Bongrad-problem scraper.py"], "default": False},
+    "sort_report": {"fn": stage_sort_report, "inputs": ["report_file"], "outputs": ["sorted_report"],
+                    "params": [], "scripts": ["sort.py"]},
+    "compose": {"fn": stage_compose, "inputs": ["raw_dir"], "outputs": ["struct_dir"],
+                "params": [], "scripts": ["split.py"]},
+    "augment": {"fn": stage_augment, "inputs": ["raw_dir"], "outputs": ["augment_dir"],
+                "params": [], "scripts": ["split for special case.py"]},
+    "kohya": {"fn": stage_kohya, "inputs": ["struct_dir", "kohya_config"], "outputs": ["train_dir"],
+              "params": [], "scripts": ["kohya_export.py"]},
+    "mcq": {"fn": stage_mcq, "inputs": ["raw_dir"], "outputs": ["mcq_json"],
+            "params": ["mcq_difficulty"], "scripts": ["mutiple_choice_generate.py", "shape_features.py"]},
+    "rules": {"fn": stage_rules, "inputs": ["mcq_json"], "outputs": ["refined_json"],
+              "params": [], "scripts": ["update_rules.py"]},
+    "evaluate": {"fn": stage_evaluate, "inputs": ["refined_json", "raw_dir"], "outputs": [],
+                 "params": ["model_path", "prompt_mode", "decode_mode"],
+                 "scripts": ["test_qwen_vl.py"], "default": False},
+}
+
+
+def stage_deps(name):
+    inputs = set(STAGES[name]["inputs"])
+    return [other for other, s in STAGES.items() if other != name and inputs & set(s["outputs"])]
+
+
+def select_stages(targets):
+    """
+    目标阶段 + 它们 (传递) 依赖的默认阶段
+    """
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name in selected:
+            continue
+        if name not in STAGES:
+            raise KeyError(f"未知阶段: {name} (可选: {', '.join(STAGES)})")
+        selected.add(name)
+        todo.extend(d for d in stage_deps(name) if STAGES[d].get("default", True))
+    return selected
+
+
+# ====================================================================
+# 缓存：输入文件 (大小, 修改时间) + 参数 + 脚本源码 -> 指纹
+# ====================================================================
+def fingerprint_path(path):
+    h = hashlib.sha1()
+    if os.path.isfile(path):
+        st = os.stat(path)
+        h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    elif os.path.isdir(path):
+        for dirpath, dirnames, files in os.walk(path):
+            dirnames.sort()
+            for name in sorted(files):
+                st = os.stat(os.path.join(dirpath, name))
+                rel = os.path.relpath(os.path.join(dirpath, name), path)
+                h.update(f"{rel}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    else:
+        return None
+    return h.hexdigest()
+
+
+def stage_key(name, cfg):
+    s = STAGES[name]
+    payload = {
+        "stage": name,
+        "params": {k: cfg[k] for k in s["params"]},
+        "inputs": {k: fingerprint_path(cfg[k]) for k in s["inputs"]},
+        "outputs": [cfg[k] for k in s["outputs"]],
+        "scripts": {f: fingerprint_path(os.path.join(REPO_ROOT, f)) for f in s["scripts"]},
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def load_cache(path=CACHE_FILE):
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_cache(cache, path=CACHE_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+
+
+def is_fresh(name, cfg, cache):
+    entry = cache.get(name)
+    s = STAGES[name]
+    return (entry is not None and entry["key"] == stage_key(name, cfg)
+            and all(os.path.exists(cfg[k]) for k in s["outputs"]))
+
+
+# ====================================================================
+# 调度：依赖满足的阶段同时开跑 (线程)，每个 BP 的重活分给共享进程池
+# ====================================================================
+def run_pipeline(targets, cfg, force=False):
+    selected = select_stages(targets)
+    cache = load_cache()
+    status, results = {}, {}
+    print(f"🚀 运行阶段: {', '.join(n for n in STAGES if n in selected)} ({cfg['workers']} 个进程)")
+
+    def run_one(name):
+        start = time.perf_counter()
+        count = STAGES[name]["fn"](cfg, pool)
+        return count, time.perf_counter() - start
+
+    # 用 spawn 而不是 fork：几个阶段线程会同时 import 模块，fork 出来的子进程可能继承一把被占着的 import 锁然后卡死
+    # (Windows 本来就是 spawn，两边行为一致)
+    with ProcessPoolExecutor(max_workers=cfg["workers"], mp_context=multiprocessing.get_context("spawn")) as pool, \
+            ThreadPoolExecutor(max_workers=len(selected)) as runner:
+        running = {}
+        while len(status) < len(selected):
+            for name in STAGES:
+                if name not in selected or name in status or name in running.values():
+                    continue
+                deps = [d for d in stage_deps(name) if d in selected]
+                if any(status.get(d) in ("failed", "skipped") for d in deps):
+                    status[name] = "skipped"
+                    results[name] = {"reason": "上游阶段没有成功"}
+                    continue
+                if not all(status.get(d) in ("done", "cached") for d in deps):
+                    continue
+                missing = [cfg[k] for k in STAGES[name]["inputs"] if not os.path.exists(cfg[k])]
+                if missing:
+                    status[name] = "skipped"
+                    results[name] = {"reason": f"缺少输入: {', '.join(missing)}"}
+                    print(f"⚠️ {name}: 缺少输入 {missing}，跳过")
+                elif not force and is_fresh(name, cfg, cache):
+                    status[name] = "cached"
+                    results[name] = {"seconds": 0.0}
+                    print(f"♻️ {name}: 输入没变，使用缓存结果")
+                else:
+                    print(f"▶️ {name}: 开始")
+                    running[runner.submit(run_one, name)] = name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    count, seconds = future.result()
+                    status[name] = "done"
+                    results[name] = {"seconds": round(seconds, 2), "items": count}
+                    # 指纹在跑完之后算，这样阶段运行期间输入被改动也会在下次重跑
+                    cache[name] = {"key": stage_key(name, cfg), "finished_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+                    save_cache(cache)
+                    print(f"✅ {name}: 完成 ({seconds:.1f}s)")
+                except Exception as e:
+                    status[name] = "failed"
+                    results[name] = {"error": f"{type(e).__name__}: {e}"}
+                    print(f"❌ {name}: {type(e).__name__}: {e}")
+
+    print("\n" + "=" * 40)
+    print("📊 流水线运行报告")
+    print("-" * 40)
+    icons = {"done": "✅", "cached": "♻️", "skipped": "⚠️", "failed": "❌"}
+    for name in STAGES:
+        if name in status:
+            r = results[name]
+            detail = f"{r['seconds']:.1f}s" if "seconds" in r else r.get("reason") or r.get("error")
+            print(f"{icons[status[name]]} {name:<12} {status[name]:<8} {detail}")
+    print("=" * 40 + "\n")
+    return status
+
+
+def list_stages(cfg):
+    cache = load_cache()
+    print(f"{'阶段':<12}{'依赖':<24}{'默认':<6}状态")
+    for name, s in STAGES.items():
+        deps = ", ".join(stage_deps(name)) or "-"
+        default = "是" if s.get("default", True) else "否"
+        if any(not os.path.exists(cfg[k]) for k in s["inputs"]):
+            state = "缺少输入"
+        else:
+            state = "最新" if is_fresh(name, cfg, cache) else "需要运行"
+        print(f"{name:<12}{deps:<24}{default:<6}{state}")
+
+
+if __name__ == "__main__":
+    # python pipeline.py list                    -> 查看阶段 DAG 和缓存状态
+    # python pipeline.py rebuild                 -> 爬完之后一键重建所有默认阶段 (用满所有核)
+    # python pipeline.py run mcq evaluate        -> 跑指定阶段 (自动带上依赖)
+    # python pipeline.py run crawl               -> 联网爬虫 / evaluate 需要显式点名
+    # --set key=value 覆盖配置，例如 --set mcq_difficulty=hard；--force 忽略缓存
+    parser = argparse.ArgumentParser(description="Bongard 数据流水线")
+    parser.add_argument("command", choices=["list", "run", "rebuild"])
+    parser.add_argument("stages", nargs="*")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument("--set", action="append", default=[], dest="overrides")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    cfg = load_config(args.config, args.overrides)
+    if args.workers:
+        cfg["workers"] = args.workers
+
+    if args.command == "list":
+        list_stages(cfg)
+    else:
+        targets = args.stages if args.command == "run" else [n for n, s in STAGES.items() if s.get("default", True)]
+        status = run_pipeline(targets, cfg, args.force)
+        sys.exit(1 if "failed" in status.values() else 0)
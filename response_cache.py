@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from importlib import metadata
+from threading import Lock
+from instrumentation import incr
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+# 持久化的模型回答缓存：同一个 (模型, 处理器设置, 提示内容, 图片字节) 只推理一次
+CACHE_FILE = "response_cache.sqlite"
+MAX_CACHE_MB = 256          # 超过就按最近使用时间 (LRU) 删最旧的
+# 模型目录里这些小文件直接哈希内容；权重文件太大，只记 (文件名, 大小, 修改时间)
+MODEL_META_FILES = ("config.json", "generation_config.json", "preprocessor_config.json",
+                    "tokenizer_config.json", "chat_template.json", "chat_template.jinja")
+WEIGHT_EXTS = (".safetensors", ".bin", ".pt")
+# 这些库决定了提示怎么渲染成 token、图片怎么预处理、模型怎么算：升级后 chat template 的渲染代码、
+# 图片缩放/切 patch 的逻辑都可能变，所以版本号也放进 key (用包元数据查，不用 import，命中缓存时仍不加载模型)
+LIBRARY_PACKAGES = ("transformers", "qwen-vl-utils", "torch", "accelerate", "bitsandbytes", "pillow")
+
+
+def model_fingerprint(model_path):
+    """
+    模型 checkpoint 的指纹：配置文件内容 + 权重文件的名字/大小/修改时间
+    路径不存在 (例如在别的机器上分析) 时只用路径本身
+    """
+    h = hashlib.sha256(model_path.encode("utf-8"))
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            full = os.path.join(model_path, name)
+            if name in MODEL_META_FILES:
+                with open(full, "rb") as f:
+                    h.update(name.encode() + f.read())
+            elif name.endswith(WEIGHT_EXTS):
+                st = os.stat(full)
+                h.update(f"{name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def library_versions():
+    """
+    {包名: 版本}，没装的记为 None
+    """
+    versions = {}
+    for name in LIBRARY_PACKAGES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+class ResponseCache:
+    """
+    sqlite3 存储，一行一个回答 (预测字母 + 额外字段 JSON)，记录大小和最近使用时间
+    命中/未命中/淘汰次数同时记在本次运行的计数和库里的累计统计里
+    """
+
+    def __init__(self, path=CACHE_FILE, max_mb=MAX_CACHE_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = Lock()
+        self.session = {"hits": 0, "misses": 0, "evictions": 0}
+        self._image_hashes = {}
+        self._model_fps = {}
+        self._libraries = library_versions()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                prediction TEXT NOT NULL,
+                extra TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_last_used ON responses (last_used);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        """)
+        self.db.commit()
+
+    # ----------------------------------------------------------------
+    # 缓存 key
+    # ----------------------------------------------------------------
+    def image_hash(self, path):
+        """
+        图片内容的哈希；同一个文件 (路径, 大小, 修改时间) 没变就不重复读
+        """
+        st = os.stat(path)
+        stamp = (path, st.st_size, st.st_mtime_ns)
+        if stamp not in self._image_hashes:
+            with open(path, "rb") as f:
+                self._image_hashes[stamp] = hashlib.sha256(f.read()).hexdigest()
+        return self._image_hashes[stamp]
+
+    def make_key(self, model_path, settings, messages):
+        """
+        key = sha256(模型指纹, 处理器/解码设置, 库版本, 按顺序展开的提示文字 + 图片内容哈希)
+        图片按内容算，所以题目重新生成、文件换了路径，只要像素一样还是命中
+        chat template 本身在模型目录的 chat_template.json / tokenizer_config.json 里 (算在模型指纹中)，
+        渲染它和预处理图片的代码由 transformers / qwen_vl_utils 的版本决定
+        """
+        if model_path not in self._model_fps:
+            self._model_fps[model_path] = model_fingerprint(model_path)
+        parts = []
+        for message in messages:
+            parts.append(["role", message["role"]])
+            for item in message["content"]:
+                if item["type"] == "image":
+                    path = item["image"][len("file://"):] if item["image"].startswith("file://") else item["image"]
+                    parts.append(["image", self.image_hash(path)])
+                else:
+                    parts.append([item["type"], item.get("text", "")])
+        payload = json.dumps({
+            "model": self._model_fps[model_path],
+            "settings": settings,
+            "libraries": self._libraries,
+            "prompt": parts,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ----------------------------------------------------------------
+    # 读写
+    # ----------------------------------------------------------------
+    def _bump(self, name, value=1):
+        self.session[name] += value
+        self.db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, value, value)
+        )
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT prediction, extra FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._bump("misses")
+                self.db.commit()
+                incr("response_cache", result="miss")
+                return None
+            self.db.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self._bump("hits")
+            self.db.commit()
+        incr("response_cache", result="hit")
+        return row[0], json.loads(row[1])
+
+    def put(self, key, prediction, extra):
+        extra_json = json.dumps(extra, ensure_ascii=False)
+        size = len(key) + len(prediction) + len(extra_json.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, prediction, extra, bytes, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, prediction, extra_json, size, now, now)
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """
+        总大小超过上限就从最久没用的开始删，删到上限的 90% (避免每次插入都触发)
+        """
+        (total,) = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        removed, freed = [], 0
+        for key, size in self.db.execute("SELECT key, bytes FROM responses ORDER BY last_used ASC"):
+            if total - freed <= target:
+                break
+            removed.append((key,))
+            freed += size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", removed)
+        self._bump("evictions", len(removed))
+        incr("response_cache_evictions", len(removed))
+
+    def stats(self):
+        with self.lock:
+            entries, total = self.db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM responses").fetchone()
+            lifetime = dict(self.db.execute("SELECT name, value FROM stats").fetchall())
+        looked_up = self.session["hits"] + self.session["misses"]
+        return {
+            "entries": entries,
+            "size_mb": round(total / 1024 / 1024, 3),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 3),
+            "session": dict(self.session),
+            "session_hit_rate": self.session["hits"] / looked_up if looked_up else 0.0,
+            "lifetime": {k: lifetime.get(k, 0) for k in ("hits", "misses", "evictions")},
+        }
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.execute("DELETE FROM stats")
+            self.db.commit()
+            self.db.execute("VACUUM")
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == "__main__":
+    # python response_cache.py          -> 查看缓存大小和累计命中率
+    # python response_cache.py clear    -> 清空缓存
+    cache = ResponseCache()
+    if len(sys.argv) > 1 and sys.argv[1] == "clear":
+        cache.clear()
+        print(f"🗑️ 已清空: {CACHE_FILE}")
+    else:
+        s = cache.stats()
+        life = s["lifetime"]
+        looked_up = life["hits"] + life["misses"]
+        print(f"🗄️ {CACHE_FILE}: {s['entries']} 条，{s['size_mb']} / {s['max_mb']} MB")
+        print(f"🎯 累计命中 {life['hits']} / 未命中 {life['misses']} "
+              f"({life['hits'] / looked_up * 100 if looked_up else 0:.1f}%)，淘汰 {life['evictions']} 条")
@@ -0,0 +1,430 @@
+import os
+import sys
+import json
+import time
+import zlib
+import numpy as np
+from multiprocessing import Pool
+from PIL import Image
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+DATASET_ROOT = "Bongard_Dataset_v2"
+FEATURE_FILE = "shape_features.npz"
+JSON_PATH = "bongard_v2_dual_tasks.json"
+PREDICTION_FILE = "heuristic_predictions.json"
+HARD_QUESTIONS_FILE = "bongard_v2_hard_questions.json"
+
+VALID_EXTS = (".png", ".gif", ".jpg", ".jpeg", ".bmp")
+MASK_SIZE = 64             # 所有小图先缩成 64x64 的黑白掩码再算特征
+INK_THRESHOLD = 128        # 灰度 < 128 算 "墨迹"
+BATCH_SIZE = 1024
+NUM_WORKERS = os.cpu_count() or 4
+
+# 分流：置信度阈值不拍脑袋定，而是在带答案的题目上量出来——
+# 取 "置信度 >= 阈值的题目准确率 >= TRIAGE_TARGET_PRECISION" 的最低阈值，其余题目交给 Qwen-VL
+# 按 BP 分两半：一半用来定阈值，另一半报告这个阈值的实际准确率 (避免自己给自己打分)
+# 达不到目标准确率就不分流 (全部交给 Qwen-VL)
+TRIAGE_TARGET_PRECISION = 0.8
+TRIAGE_MIN_COUNT = 20      # 高置信度那一档至少要有这么多题，准确率才算数
+
+FEATURE_NAMES = [
+    "ink_ratio", "bbox_width", "bbox_height", "bbox_aspect", "bbox_extent",
+    "centroid_x", "centroid_y", "hu1", "hu2", "eccentricity",
+    "components", "holes", "filled_ratio", "hull_area", "hull_perimeter",
+    "solidity", "circularity", "boundary_ratio",
+    "symmetry_lr", "symmetry_ud", "symmetry_rot180",
+]
+# 特征算法改了就加 1，旧缓存里的行全部重算 (2: 背景改用 4 邻域，修正斜边轮廓的孔洞数)
+FEATURE_VERSION = 2
+
+
+# ====================================================================
+# 读图 -> 墨迹掩码
+# ====================================================================
+def load_mask(path):
+    """
+    读图 -> 透明背景铺白 -> 灰度 -> 64x64 -> 二值化 (在子进程里跑)
+    """
+    try:
+        with Image.open(path) as img:
+            rgba = img.convert("RGBA")
+            canvas = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+            canvas.alpha_composite(rgba)
+            gray = canvas.convert("L").resize((MASK_SIZE, MASK_SIZE), Image.BILINEAR)
+        mask = np.asarray(gray) < INK_THRESHOLD
+        # oebp.org 的原图大多带一圈黑色边框，去掉最外 2 像素避免所有图都连成一个整体
+        mask[:2, :] = mask[-2:, :] = False
+        mask[:, :2] = mask[:, -2:] = False
+        return np.packbits(mask)
+    except Exception:
+        return None
+
+
+# ====================================================================
+# 批量特征 (一次处理 N 张图，全部用数组运算)
+# ====================================================================
+def _neighbor_max(labels, mask, connectivity=8):
+    """
+    邻域最大值传播 (只在 mask 内)
+    8 邻域：先横向再纵向取最大，等价于 3x3 窗口
+    4 邻域：上下左右各取一次，不走对角线
+    """
+    row = labels.copy()
+    np.maximum(row[:, :, 1:], labels[:, :, :-1], out=row[:, :, 1:])
+    np.maximum(row[:, :, :-1], labels[:, :, 1:], out=row[:, :, :-1])
+    best = row.copy()
+    src = row if connectivity == 8 else labels
+    np.maximum(best[:, 1:], src[:, :-1], out=best[:, 1:])
+    np.maximum(best[:, :-1], src[:, 1:], out=best[:, :-1])
+    best[~mask] = 0
+    return best
+
+
+def count_components(masks, connectivity=8):
+    """
+    批量连通分量计数：每个像素的标签初始化为自己的编号，
+    反复做 "邻域取最大 + 指针跳跃"，收敛后每个分量的标签都等于分量里最大的编号
+    每轮只处理还没收敛的图片
+    墨迹用 8 邻域，背景要用 4 邻域 (否则背景会从 1 像素宽的斜线缝里漏进去，圆/三角形都数不出孔洞)
+    """
+    n, h, w = masks.shape
+    idx = np.arange(1, h * w + 1, dtype=np.int16).reshape(1, h, w)
+    labels = np.where(masks, idx, 0).astype(np.int16)
+    active = np.arange(n)
+    while len(active):
+        cur, m = labels[active], masks[active]
+        new = _neighbor_max(cur, m, connectivity)
+        # 指针跳跃：标签指向的那个像素如果已经有更大的标签，直接跳过去
+        flat = new.reshape(len(active), -1)
+        jumped = np.take_along_axis(flat, np.maximum(flat.astype(np.int32) - 1, 0), axis=1)
+        np.maximum(flat, jumped, out=flat)
+        new[~m] = 0
+        changed = (new != cur).reshape(len(active), -1).any(axis=1)
+        labels[active] = new
+        active = active[changed]
+    roots = (labels == idx) & masks
+    return roots.reshape(n, -1).sum(axis=1), labels
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull_stats(mask):
+    """
+    单张图的凸包面积和周长 (Andrew 单调链)
+    只用每一行最左/最右的墨迹像素作为候选点，最多 2*64 个点
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if len(rows) == 0:
+        return 0.0, 0.0
+    left = mask[rows].argmax(axis=1)
+    right = mask.shape[1] - 1 - mask[rows, ::-1].argmax(axis=1)
+    # 用像素的四个角，单像素宽的线也有面积
+    pts = set()
+    for r, l, rr in zip(rows.tolist(), left.tolist(), right.tolist()):
+        pts.update([(l, r), (l, r + 1), (rr + 1, r), (rr + 1, r + 1)])
+    pts = sorted(pts)
+    if len(pts) < 3:
+        return 0.0, 0.0
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and _cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and _cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    hull = np.array(lower[:-1] + upper[:-1], dtype=np.float64)
+
+    x, y = hull[:, 0], hull[:, 1]
+    area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    perimeter = np.sqrt(((hull - np.roll(hull, -1, axis=0)) ** 2).sum(axis=1)).sum()
+    return area, perimeter
+
+
+def _mirror(masks, lo, hi, axis):
+    """
+    以每张图自己的包围盒中心为轴做镜像 (坐标 x -> lo + hi - x)，越界的位置补 False
+    """
+    n, h, w = masks.shape
+    size = masks.shape[axis]
+    coords = np.arange(size).reshape((1, size, 1) if axis == 1 else (1, 1, size))
+    shape = (n, 1, 1)
+    src = lo.reshape(shape) + hi.reshape(shape) - coords
+    inside = (src >= 0) & (src < size)
+    src = np.broadcast_to(np.clip(src, 0, size - 1), masks.shape)
+    return np.take_along_axis(masks, src, axis=axis) & inside
+
+
+def _symmetry(m, flipped):
+    inter = (m & flipped).reshape(len(m), -1).sum(axis=1)
+    union = (m | flipped).reshape(len(m), -1).sum(axis=1)
+    return inter / np.maximum(union, 1)
+
+
+def extract_features(masks):
+    """
+    masks: (N, 64, 64) bool，返回 (N, len(FEATURE_NAMES)) float32
+    """
+    n, h, w = masks.shape
+    m = masks.astype(np.float64)
+    area = m.reshape(n, -1).sum(axis=1)
+    safe_area = np.maximum(area, 1)
+
+    # 1. 包围盒
+    rows_any, cols_any = masks.any(axis=2), masks.any(axis=1)
+    top, bottom = rows_any.argmax(axis=1), h - 1 - rows_any[:, ::-1].argmax(axis=1)
+    left, right = cols_any.argmax(axis=1), w - 1 - cols_any[:, ::-1].argmax(axis=1)
+    bw = np.where(area > 0, right - left + 1, 0)
+    bh = np.where(area > 0, bottom - top + 1, 0)
+
+    # 2. 矩：质心、归一化中心矩、Hu 矩前两个、离心率
+    ys, xs = np.mgrid[0:h, 0:w]
+    cx = (m * xs).reshape(n, -1).sum(axis=1) / safe_area
+    cy = (m * ys).reshape(n, -1).sum(axis=1) / safe_area
+    dx = xs[None] - cx[:, None, None]
+    dy = ys[None] - cy[:, None, None]
+    mu20 = (m * dx ** 2).reshape(n, -1).sum(axis=1)
+    mu02 = (m * dy ** 2).reshape(n, -1).sum(axis=1)
+    mu11 = (m * dx * dy).reshape(n, -1).sum(axis=1)
+    eta20, eta02, eta11 = mu20 / safe_area ** 2, mu02 / safe_area ** 2, mu11 / safe_area ** 2
+    hu1 = eta20 + eta02
+    hu2 = (eta20 - eta02) ** 2 + 4 * eta11 ** 2
+    common = np.sqrt((mu20 - mu02) ** 2 + 4 * mu11 ** 2)
+    lam1, lam2 = (mu20 + mu02 + common) / 2, (mu20 + mu02 - common) / 2
+    eccentricity = np.sqrt(np.clip(1 - lam2 / np.maximum(lam1, 1e-9), 0, 1))
+
+    # 3. 连通分量和孔洞：背景外面补一圈，这样外部背景是一个分量，其余背景分量就是孔洞
+    #    墨迹 8 邻域、背景 4 邻域 (两者互补，斜边轮廓才算封闭)
+    components, _ = count_components(masks)
+    bg = ~np.pad(masks, ((0, 0), (1, 1), (1, 1)))
+    bg_components, bg_labels = count_components(bg, connectivity=4)
+    holes = np.maximum(bg_components - 1, 0)
+    outer = bg_labels == bg_labels[:, :1, :1]
+    filled = (~outer).reshape(n, -1).sum(axis=1)  # 墨迹 + 孔洞 的面积
+
+    # 4. 轮廓：和背景 4 邻接的墨迹像素数 (近似周长)
+    p = np.pad(masks, ((0, 0), (1, 1), (1, 1)))
+    interior = p[:, :-2, 1:-1] & p[:, 2:, 1:-1] & p[:, 1:-1, :-2] & p[:, 1:-1, 2:]
+    boundary = (masks & ~interior).reshape(n, -1).sum(axis=1)
+
+    # 5. 凸包 (每张图单独算，点数很少)
+    hull = np.array([convex_hull_stats(mk) for mk in masks])
+    hull_area, hull_perim = hull[:, 0], hull[:, 1]
+
+    # 6. 对称性：以包围盒中心为轴，左右、上下镜像和旋转 180 度后的 IoU
+    flip_lr = _mirror(masks, left, right, axis=2)
+    flip_ud = _mirror(masks, top, bottom, axis=1)
+    sym_lr = _symmetry(masks, flip_lr)
+    sym_ud = _symmetry(masks, flip_ud)
+    sym_rot = _symmetry(masks, _mirror(flip_lr, top, bottom, axis=1))
+
+    total = float(h * w)
+    feats = np.stack([
+        area / total, bw / w, bh / h, bw / np.maximum(bh, 1), area / np.maximum(bw * bh, 1),
+        cx / w, cy / h, hu1, hu2, eccentricity,
+        components, holes, filled / total, hull_area / total, hull_perim / (2 * (h + w)),
+        filled / np.maximum(hull_area, 1), 4 * np.pi * hull_area / np.maximum(hull_perim ** 2, 1),
+        boundary / safe_area,
+        sym_lr, sym_ud, sym_rot,
+    ], axis=1)
+    return feats.astype(np.float32)
+
+
+# ====================================================================
+# 列式缓存
+# ====================================================================
+def scan_tiles(dataset_root=DATASET_ROOT):
+    keys = []
+    for folder in sorted(os.listdir(dataset_root)):
+        folder_path = os.path.join(dataset_root, folder)
+        if not (folder.startswith("BP") and os.path.isdir(folder_path)):
+            continue
+        for name in sorted(os.listdir(folder_path)):
+            if name.lower().endswith(VALID_EXTS) and "combined" not in name:
+                keys.append(f"{folder}/{name}")
+    return keys
+
+
+def build_feature_cache(dataset_root=DATASET_ROOT, feature_file=FEATURE_FILE, num_workers=NUM_WORKERS):
+    """
+    给所有小图算特征，按列存进 npz (每个特征一列 + key 列 "BPxx/文件名")
+    (大小, 修改时间) 没变的图片直接复用旧结果
+    """
+    start = time.perf_counter()
+    keys = scan_tiles(dataset_root)
+    paths = [os.path.join(dataset_root, k) for k in keys]
+    stamps = np.array([f"{os.path.getsize(p)}:{os.path.getmtime(p):.0f}" for p in paths])
+    feats = np.zeros((len(keys), len(FEATURE_NAMES)), dtype=np.float32)
+    valid = np.zeros(len(keys), dtype=bool)
+
+    todo = list(range(len(keys)))
+    old = load_feature_cache(feature_file) if os.path.exists(feature_file) else None
+    if old is not None and old["version"] == FEATURE_VERSION:
+        old_rows = {(k, s): i for i, (k, s) in enumerate(zip(old["keys"], old["stamps"]))}
+        todo = []
+        for i, key in enumerate(zip(keys, stamps)):
+            j = old_rows.get(key)
+            if j is None:
+                todo.append(i)
+            else:
+                feats[i], valid[i] = old["features"][j], old["valid"][j]
+
+    print(f"🔍 共 {len(keys)} 张小图，需要计算特征 {len(todo)} 张")
+    if todo:
+        with Pool(num_workers) as pool:
+            packed = pool.map(load_mask, [paths[i] for i in todo], chunksize=64)
+            pool.close()  # 正常收尾 (不被 terminate)，子进程的埋点才会导出
+            pool.join()
+        todo = np.array(todo)
+        ok = np.array([p is not None for p in packed])
+        good = todo[ok]
+        masks = np.unpackbits(np.stack([p for p in packed if p is not None]), axis=1)
+        masks = masks[:, :MASK_SIZE * MASK_SIZE].reshape(-1, MASK_SIZE, MASK_SIZE).astype(bool)
+        for s in range(0, len(good), BATCH_SIZE):
+            feats[good[s:s + BATCH_SIZE]] = extract_features(masks[s:s + BATCH_SIZE])
+        valid[good] = True
+
+    columns = {name: feats[:, i] for i, name in enumerate(FEATURE_NAMES)}
+    np.savez(feature_file, keys=np.array(keys), stamps=stamps, valid=valid, version=FEATURE_VERSION, **columns)
+    print(f"💾 特征已保存至: {feature_file} ({time.perf_counter() - start:.1f}s)")
+    return load_feature_cache(feature_file)
+
+
+def load_feature_cache(feature_file=FEATURE_FILE):
+    data = np.load(feature_file)
+    features = np.stack([data[name] for name in FEATURE_NAMES], axis=1)
+    version = int(data["version"]) if "version" in data.files else 1
+    return {"keys": data["keys"], "stamps": data["stamps"], "valid": data["valid"], "features": features,
+            "version": version}
+
+
+# ====================================================================
+# 最近质心求解器
+# ====================================================================
+def solve_questions(questions, cache):
+    """
+    对所有题目一次性求解：
+    每道题的 5 张 Context 求特征质心，4 个选项里离质心最近 (按 Context 自身的离散程度加权) 的就是答案
+    置信度 = (第二近 - 最近) / 第二近
+    """
+    row = {k: i for i, k in enumerate(cache["keys"].tolist())}
+    feats = cache["features"]
+    # 全局标准化，防止数值大的特征 (连通分量数) 主导距离
+    mu, sigma = feats[cache["valid"]].mean(axis=0), feats[cache["valid"]].std(axis=0) + 1e-6
+    z = (feats - mu) / sigma
+
+    ctx_idx = np.array([[row[f"{q['bp']}/{img}"] for img in q["context"]] for q in questions])
+    opt_idx = np.array([[row[f"{q['bp']}/{img}"] for img in q["options"]] for q in questions])
+    ctx, opts = z[ctx_idx], z[opt_idx]                      # (Q, 5, F), (Q, 4, F)
+
+    centroid = ctx.mean(axis=1, keepdims=True)              # (Q, 1, F)
+    spread = ctx.std(axis=1, keepdims=True) + 0.25          # Context 内部越一致的特征权重越大
+    dist = np.sqrt((((opts - centroid) / spread) ** 2).mean(axis=2))  # (Q, 4)
+
+    order = np.argsort(dist, axis=1)
+    best = order[:, 0]
+    d1 = np.take_along_axis(dist, order[:, :1], axis=1)[:, 0]
+    d2 = np.take_along_axis(dist, order[:, 1:2], axis=1)[:, 0]
+    confidence = (d2 - d1) / np.maximum(d2, 1e-6)
+    return best, confidence, dist
+
+
+def calibrate_threshold(confidence, is_correct, target=TRIAGE_TARGET_PRECISION, min_count=TRIAGE_MIN_COUNT):
+    """
+    置信度从高到低排，算 "前 k 道" 的累计准确率，返回满足 准确率 >= target 且 k >= min_count 的最低阈值
+    找不到返回 inf (一道题都不算高置信度)
+    """
+    order = np.argsort(-confidence, kind="stable")
+    conf, correct = confidence[order], is_correct[order]
+    precision = np.cumsum(correct) / np.arange(1, len(correct) + 1)
+    # 同一个置信度的题要么全进要么全不进，只在置信度变化的位置切
+    cut = np.r_[conf[1:] != conf[:-1], True]
+    ok = np.flatnonzero(cut & (precision >= target) & (np.arange(1, len(conf) + 1) >= min_count))
+    return float(conf[ok[-1]]) if len(ok) else float("inf")
+
+
+def run_solver(json_path=JSON_PATH, dataset_root=DATASET_ROOT, threshold=None):
+    """
+    threshold=None：在题目自带的答案上按 BP 分两半标定阈值 (见 calibrate_threshold)
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    questions = data["questions"]
+
+    # 每次都走增量构建：没变的图片直接复用缓存里的行，新加的 BP 也会被算进去
+    cache = build_feature_cache(dataset_root)
+
+    start = time.perf_counter()
+    best, confidence, dist = solve_questions(questions, cache)
+    elapsed = time.perf_counter() - start
+
+    is_correct = np.array([chr(65 + b) == q["correct"] for q, b in zip(questions, best.tolist())])
+    held_out = np.array([zlib.crc32(q["bp"].encode()) % 2 == 1 for q in questions])
+    if threshold is None:
+        threshold = calibrate_threshold(confidence[~held_out], is_correct[~held_out])
+    confident = confidence >= threshold
+    held_confident = confident & held_out
+    held_precision = is_correct[held_confident].mean() if held_confident.any() else 0.0
+
+    predictions = []
+    hard = []
+    for q, b, c, d in zip(questions, best.tolist(), confidence.tolist(), dist.tolist()):
+        pred = chr(65 + b)
+        predictions.append({
+            "id": q["question_id"],
+            "target_side": q["target_side"],
+            "prediction": pred,
+            "ground_truth": q["correct"],
+            "is_correct": pred == q["correct"],
+            "confidence": round(c, 4),
+            "distances": [round(v, 4) for v in d]
+        })
+        if c < threshold:
+            hard.append(q)
+
+    with open(PREDICTION_FILE, "w", encoding="utf-8") as f:
+        json.dump(predictions, f, indent=4)
+
+    # 难题单独存一份，格式和原 JSON 一样，可以直接作为 test_qwen_vl.py 的 JSON_PATH
+    with open(HARD_QUESTIONS_FILE, "w", encoding="utf-8") as f:
+        json.dump({
+            "dataset_info": data.get("dataset_info", "") + f" (heuristic confidence < {threshold})",
+            "statistics": {"total_questions_generated": len(hard)},
+            "questions": hard
+        }, f, indent=4, ensure_ascii=False)
+
+    n = len(predictions)
+    easy = [p for p, c in zip(predictions, confident.tolist()) if c]
+    acc = sum(p["is_correct"] for p in predictions) / n if n else 0
+    easy_acc = sum(p["is_correct"] for p in easy) / len(easy) if easy else 0
+
+    print("\n" + "=" * 40)
+    print("📐 形状特征启发式求解报告")
+    print("-" * 40)
+    print(f"📝 题目总数:          {n}")
+    print(f"🎯 整体准确率:        {acc * 100:.2f}% (随机 25%)")
+    if np.isinf(threshold):
+        print(f"⚠ 没有哪个置信度阈值能让准确率达到 {TRIAGE_TARGET_PRECISION * 100:.0f}%，不分流，全部交给 Qwen-VL")
+    else:
+        print(f"📏 标定出的阈值:      {threshold:.4f} (目标准确率 {TRIAGE_TARGET_PRECISION * 100:.0f}%)")
+        print(f"✅ 高置信度题目:      {len(easy)} 道，准确率 {easy_acc * 100:.2f}% "
+              f"(留出的一半 BP 上 {int(held_confident.sum())} 道，准确率 {held_precision * 100:.2f}%)")
+    print(f"🧠 交给 Qwen-VL 的难题: {len(hard)} 道 -> {HARD_QUESTIONS_FILE}")
+    print(f"⏱️ 求解耗时:          {elapsed * 1000:.1f}ms")
+    print("=" * 40 + "\n")
+    return predictions
+
+
+if __name__ == "__main__":
+    # python shape_features.py                 -> 算特征 (有缓存就增量更新)
+    # python shape_features.py solve [json]    -> 用特征做启发式求解 + 分流难题
+    if len(sys.argv) > 1 and sys.argv[1] == "solve":
+        run_solver(sys.argv[2] if len(sys.argv) > 2 else JSON_PATH)
+    else:
+        build_feature_cache()
@@ -1,10 +1,9 @@
 import re
 
-# 读取原始报告
-with open("patterns_report.txt", "r", encoding="utf-8") as f:
-    raw_data = f.read()
+# 爬虫写出来的报告 (大于 12 张图的题目)
+REPORT_FILE = "patterns_report.txt"
 
-def sort_patterns(text):
+def sort_patterns(text, output_file=REPORT_FILE):
     # 1. 提取 ID 和 数量
     pattern = r"ID:\s*(BP\d+)\s*\|\s*Total Images:\s*(\d+)"
     matches = re.findall(pattern, text)
@@ -14,16 +13,26 @@ def sort_patterns(text):
     sorted_list = sorted(matches, key=lambda x: int(x[1]))
     
     # 3. 格式化输出并保存
-    with open("patterns_report.txt", "w", encoding="utf-8") as f:
+    with open(output_file, "w", encoding="utf-8") as f:
         f.write("--- Sorted Bongard Problems by Image Count (Ascending) ---\n")
         for bp_id, count in sorted_list:
             line = f"ID: {bp_id} | Total Images: {count}\n"
             f.write(line)
             print(line.strip())
+    return sorted_list
+
+def sort_report(report_file=REPORT_FILE, output_file=None):
+    """
+    读取报告并排序，默认原地覆盖 (import 本文件时不会读文件)
+    """
+    with open(report_file, "r", encoding="utf-8") as f:
+        raw_data = f.read()
 
-if __name__ == "__main__":
     if raw_data.strip():
-        sort_patterns(raw_data)
+        sort_patterns(raw_data, output_file or report_file)
         print(f"\n✅ 排序完成！现在是按照图片数量“从小到大”排列了。")
     else:
-        print("⚠ 文件是空的，没东西可以排序哦宝宝。")
\ No newline at end of file
+        print("⚠ 文件是空的，没东西可以排序哦宝宝。")
+
+if __name__ == "__main__":
+    sort_report()
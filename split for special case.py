@@ -3,6 +3,7 @@ import shutil
 import itertools
 import textwrap
 from PIL import Image, ImageDraw, ImageFont
+from instrumentation import span, incr
 
 # ====================================================================
 # --- 配置参数 ---
@@ -10,8 +11,6 @@ from PIL import Image, ImageDraw, ImageFont
 SOURCE_DIR = "Bongard_Dataset_v2"
 TARGET_DIR = "bongard_augmented_dataset_v3"
 
-os.makedirs(TARGET_DIR, exist_ok=True)
-
 # 你的分类名单
 RIGHT_7 = [284, 344, 351, 529, 533, 809, 917, 1003, 1008, 1065, 1115, 1122, 1184, 1202, 1283, 559]
 LEFT_7 = [352, 356, 523, 524, 860, 869, 935, 1093, 1116, 1261, 1262, 1275]
@@ -46,7 +45,10 @@ def save_variant_folder(bp_id, left_imgs, right_imgs, solution_text, variant_idx
     for i, img_path in enumerate(all_imgs):
         try:
             with Image.open(img_path) as img:
-                img_resized = img.convert("RGB").resize((SINGLE_IMG_SIZE, SINGLE_IMG_SIZE))
+                with span("image_decode"):
+                    img.load()
+                with span("image_resize"):
+                    img_resized = img.convert("RGB").resize((SINGLE_IMG_SIZE, SINGLE_IMG_SIZE))
             
             # 布局计算
             offset_x = 0 if i < 6 else (SINGLE_GROUP_WIDTH + GROUP_SPACING)
@@ -64,7 +66,9 @@ def save_variant_folder(bp_id, left_imgs, right_imgs, solution_text, variant_idx
     draw.line([(center_x, 20), (center_x, IMG_AREA_HEIGHT - 20)], fill="lightgray", width=1)
 
     # 3. 保存 combined.png
-    combined_img.save(os.path.join(variant_path, "combined.png"), "PNG")
+    with span("png_encode"):
+        combined_img.save(os.path.join(variant_path, "combined.png"), "PNG")
+    incr("augmented_variants")
 
     # 4. 保存 solution.txt
     with open(os.path.join(variant_path, "solution.txt"), "w", encoding="utf-8") as f:
@@ -107,6 +111,7 @@ def process_special_bp(bp_id):
     print(f"📦 BP{bp_id}: 已生成 {variant_count} 个变体文件夹")
 
 if __name__ == "__main__":
+    os.makedirs(TARGET_DIR, exist_ok=True)
     special_list = RIGHT_7 + LEFT_7 + LEFT_8 + BOTH_7 + RIGHT_8
     print("🚀 开始数据增强（文件夹结构版）...")
     
@@ -1,6 +1,7 @@
 import os
 import shutil
 from PIL import Image, ImageDraw
+from instrumentation import span, incr
 
 # --- 路径配置 (根据你的实际路径修改) ---
 SOURCE_DIR = "Bongard_Dataset_v2"
@@ -20,6 +21,34 @@ SINGLE_GROUP_HEIGHT = SUB_GRID_ROWS * SINGLE_IMG_SIZE + (SUB_GRID_ROWS + 1) * IM
 IMG_AREA_WIDTH = (SINGLE_GROUP_WIDTH * 2) + GROUP_SPACING
 IMG_AREA_HEIGHT = SINGLE_GROUP_HEIGHT
 
+def tile_position(i):
+    """
+    计算第 i 张小图在 2x6 拼图中的左上角坐标 (左边3x2，右边3x2)
+    """
+    group_offset_x = 0 if i < NUM_IMAGES_PER_GROUP else (SINGLE_GROUP_WIDTH + GROUP_SPACING)
+    idx = i if i < NUM_IMAGES_PER_GROUP else i - NUM_IMAGES_PER_GROUP
+    x = group_offset_x + IMG_PADDING + (idx % SUB_GRID_COLS) * (SINGLE_IMG_SIZE + IMG_PADDING)
+    y = IMG_PADDING + (idx // SUB_GRID_COLS) * (SINGLE_IMG_SIZE + IMG_PADDING)
+    return x, y
+
+def paste_tile(canvas, draw, img_path, x, y, size=SINGLE_IMG_SIZE):
+    """
+    读取一张小图，缩放后贴到画布 (x, y) 处，并画个细边框
+    其他拼图脚本 (例如 composite_question.py) 也复用这个函数
+    """
+    with Image.open(img_path) as img:
+        with span("image_decode"):
+            img.load()
+        # 已经过 ingest_validate.py 规范化的图 (RGB + 正好 size 大小) 不用再转换/缩放
+        if img.mode == "RGB" and img.size == (size, size):
+            img_res = img.copy()
+        else:
+            with span("image_resize"):
+                img_res = img.convert("RGB").resize((size, size))
+
+    draw.rectangle([x-1, y-1, x+size, y+size], outline=(200,200,200))
+    canvas.paste(img_res, (x, y))
+
 def process_to_new_struct(bp_id):
     bp_folder_name = f"BP{bp_id}"
     src_folder = os.path.join(SOURCE_DIR, bp_folder_name)
@@ -32,7 +61,7 @@ def process_to_new_struct(bp_id):
     os.makedirs(dst_folder, exist_ok=True)
 
     # 2. 处理图片：筛选出 12 张小图
-    valid_exts = (".png", ".jpg", ".jpeg")
+    valid_exts = (".png", ".gif", ".jpg", ".jpeg")
     img_files = sorted([
         f for f in os.listdir(src_folder) 
         if f.lower().endswith(valid_exts) and f != "combined.png"
@@ -45,27 +74,21 @@ def process_to_new_struct(bp_id):
 
         for i in range(12):
             img_path = os.path.join(src_folder, img_files[i])
-            with Image.open(img_path) as img:
-                img_res = img.convert("RGB").resize((SINGLE_IMG_SIZE, SINGLE_IMG_SIZE))
-            
             # 计算坐标 (2x6 布局：左边3x2，右边3x2)
-            group_offset_x = 0 if i < 6 else (SINGLE_GROUP_WIDTH + GROUP_SPACING)
-            idx = i if i < 6 else i - 6
-            x = group_offset_x + IMG_PADDING + (idx % SUB_GRID_COLS) * (SINGLE_IMG_SIZE + IMG_PADDING)
-            y = IMG_PADDING + (idx // SUB_GRID_COLS) * (SINGLE_IMG_SIZE + IMG_PADDING)
-
-            # 画个细边框
-            draw.rectangle([x-1, y-1, x+SINGLE_IMG_SIZE, y+SINGLE_IMG_SIZE], outline=(200,200,200))
-            combined_img.paste(img_res, (x, y))
+            x, y = tile_position(i)
+            paste_tile(combined_img, draw, img_path, x, y)
 
         # 中间画一条浅色分割线
         center_x = SINGLE_GROUP_WIDTH + GROUP_SPACING // 2
         draw.line([(center_x, 20), (center_x, IMG_AREA_HEIGHT - 20)], fill="lightgray", width=1)
 
         # 保存拼好的大图到新文件夹
-        combined_img.save(os.path.join(dst_folder, "combined.png"))
+        with span("png_encode"):
+            combined_img.save(os.path.join(dst_folder, "combined.png"))
+        incr("combined_images")
         print(f"✅ {bp_folder_name}: combined.png 已生成")
     else:
+        incr("bp_skipped_wrong_count")
         print(f"⚠ {bp_folder_name}: 图片数量不对 ({len(img_files)}张)，跳过拼图")
 
     # 3. 复制 solution.txt 到新文件夹
@@ -1,8 +1,12 @@
 import json
 import os
-import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
-from qwen_vl_utils import process_vision_info
+import sys
+import time
+from composite_question import build_question_composite
+from answer_calibration import load_temperature
+from eval_store import append_run, model_name
+from response_cache import ResponseCache
+from instrumentation import span, incr, observe
 
 # 1. 设定本地模型路径
 # 注意：Windows 路径建议使用 r"" 原始字符串
@@ -10,63 +14,196 @@ MODEL_PATH = r"D:\qwenVL\Qwen3-VL-8B-Instruct"
 DATASET_ROOT = r"C:\Users\fypuser\Documents\fyp-Bongard-problem-\Bongard_Dataset_v2"
 JSON_PATH = "bongard_v2_dual_tasks.json"
 
-# 2. 初始化模型
-print(f"正在从本地加载模型: {MODEL_PATH}...")
-model = Qwen2VLForConditionalGeneration.from_pretrained(
-    MODEL_PATH,
-    torch_dtype=torch.float16, # 显存小，用 float16
-    device_map="auto",
-    load_in_4bit=True,         # 开启 4-bit 量化
-)
-processor = AutoProcessor.from_pretrained(
-    MODEL_PATH, 
-    min_pixels=128 * 28 * 28,  # 约 313,600 像素
-    max_pixels=448 * 28 * 28,  # 约 351,232 像素 (比 512*28*28 更稳妥)
-)
-
-def run_evaluation():
-    # 读取 JSON 数据库
-    if not os.path.exists(JSON_PATH):
-        print(f"❌ 找不到 JSON 文件: {JSON_PATH}")
+# 提示方式："multi" = 每题 9 张独立图片；"composite" = 每题拼成一张大图 (见 composite_question.py)
+PROMPT_MODE = "multi"
+
+# 解码方式："generate" = 自回归生成再找第一个字母；"logits" = 一次前向，直接比较 A-D 四个 token 的 logits
+DECODE_MODE = "generate"
+OPTION_LETTERS = ['A', 'B', 'C', 'D']
+
+# 处理器 / 生成设置 (这些都会进响应缓存的 key，改了就不会命中旧答案)
+MIN_PIXELS = 128 * 28 * 28  # 约 313,600 像素
+MAX_PIXELS = 448 * 28 * 28  # 约 351,232 像素 (比 512*28*28 更稳妥)
+LOAD_IN_4BIT = True
+MAX_NEW_TOKENS = 10
+
+# 同一个 (模型, 设置, 提示, 图片内容) 只推理一次，答案存在 response_cache.sqlite (见 response_cache.py)
+USE_RESPONSE_CACHE = True
+_response_cache = None
+
+# 2. 模型在第一次推理时才加载 (import 本文件不会加载 torch，方便基准测试用假模型)
+model = None
+processor = None
+model_load_seconds = 0.0  # 加载模型花的时间，evaluate() 计时的时候要扣掉
+
+def load_model():
+    global torch, process_vision_info, model, processor, model_load_seconds
+    if model is not None:
         return
-        
-    with open(JSON_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+
+    load_start = time.perf_counter()
+    import torch
+    from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
+    from qwen_vl_utils import process_vision_info
+
+    print(f"正在从本地加载模型: {MODEL_PATH}...")
+    model = Qwen2VLForConditionalGeneration.from_pretrained(
+        MODEL_PATH,
+        torch_dtype=torch.float16, # 显存小，用 float16
+        device_map="auto",
+        load_in_4bit=LOAD_IN_4BIT, # 开启 4-bit 量化
+    )
+    processor = AutoProcessor.from_pretrained(
+        MODEL_PATH, 
+        min_pixels=MIN_PIXELS,
+        max_pixels=MAX_PIXELS,
+    )
+    model_load_seconds += time.perf_counter() - load_start
+    print(f"模型加载完成，用时 {model_load_seconds:.1f}s (不计入每题耗时)")
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+def build_messages(q, prompt_mode=PROMPT_MODE):
+    """
+    根据提示方式构造一道题的消息结构
+    """
+    bp_folder = q['bp']
+
+    if prompt_mode == "composite":
+        # 一张拼图：上面 5 张 Context，下面带标签的 A-D 选项
+        composite_path = build_question_composite(q, DATASET_ROOT)
+        content = [
+            {"type": "text", "text": "The top row of this image shows 5 images (Context) that follow a specific geometric or logical rule."},
+            {"type": "image", "image": f"file://{os.path.abspath(composite_path)}"},
+            {"type": "text", "text": "\nThe bottom row shows 4 options labeled A, B, C, D. Which one follows the SAME rule as the Context images?"},
+            {"type": "text", "text": "\nAnswer with the letter (A, B, C, D) only."},
+        ]
+        return [{"role": "user", "content": content}]
+
+    # 拼接图片绝对路径 (Context 5张 + Options 4张)
+    context_paths = [os.path.join(DATASET_ROOT, bp_folder, img) for img in q['context']]
+    option_paths = [os.path.join(DATASET_ROOT, bp_folder, img) for img in q['options']]
     
-    questions = data['questions']
-    results = []
+    # 提示词：告诉模型这是一个寻找规律的任务
+    content = [{"type": "text", "text": "Observe the following 5 images (Context) that follow a specific geometric or logical rule."}]
     
-    print(f"开始测试，总计题目数: {len(questions)}")
-
-    # 为了安全起见，你可以先只测试前 5 道题：questions[:5]
-    for q in questions:
-        bp_folder = q['bp']
-        
-        # 拼接图片绝对路径 (Context 5张 + Options 4张)
-        context_paths = [os.path.join(DATASET_ROOT, bp_folder, img) for img in q['context']]
-        option_paths = [os.path.join(DATASET_ROOT, bp_folder, img) for img in q['options']]
-        
-        # 3. 构造消息结构
-        # 提示词：告诉模型这是一个寻找规律的任务
-        content = [{"type": "text", "text": "Observe the following 5 images (Context) that follow a specific geometric or logical rule."}]
-        
-        # 添加 Context 图片
-        for p in context_paths:
-            content.append({"type": "image", "image": f"file://{p}"})
-        
-        content.append({"type": "text", "text": "\nNow look at these 4 options (A, B, C, D). Which one follows the SAME rule as the Context images?"})
+    # 添加 Context 图片
+    for p in context_paths:
+        content.append({"type": "image", "image": f"file://{p}"})
+    
+    content.append({"type": "text", "text": "\nNow look at these 4 options (A, B, C, D). Which one follows the SAME rule as the Context images?"})
+    
+    # 添加 Options 图片
+    for i, p in enumerate(option_paths):
+        letter = chr(65 + i)
+        content.append({"type": "text", "text": f"\nOption {letter}:"})
+        content.append({"type": "image", "image": f"file://{p}"})
         
-        # 添加 Options 图片
-        for i, p in enumerate(option_paths):
-            letter = chr(65 + i)
-            content.append({"type": "text", "text": f"\nOption {letter}:"})
-            content.append({"type": "image", "image": f"file://{p}"})
-            
-        content.append({"type": "text", "text": "\nAnswer with the letter (A, B, C, D) only."})
+    content.append({"type": "text", "text": "\nAnswer with the letter (A, B, C, D) only."})
+
+    return [{"role": "user", "content": content}]
+
+_option_token_ids = None
+
+def get_option_token_ids():
+    """
+    A-D 四个字母各自对应的 token id (只算一次)
+    """
+    global _option_token_ids
+    if _option_token_ids is None:
+        _option_token_ids = [
+            processor.tokenizer.encode(letter, add_special_tokens=False)[-1] for letter in OPTION_LETTERS
+        ]
+    return _option_token_ids
+
+def generate_answer(inputs):
+    """
+    自回归生成最多 MAX_NEW_TOKENS 个 token，再从文本里找第一个 A-D
+    """
+    with torch.no_grad(), span("generate"):
+        generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
+        generated_ids_trimmed = [
+            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        output_text = processor.batch_decode(
+            generated_ids_trimmed, 
+            skip_special_tokens=True, 
+            clean_up_tokenization_spaces=False
+        )[0].strip()
+
+    # 简单清洗输出，只取第一个字母
+    prediction = ""
+    for char in output_text.upper():
+        if char in OPTION_LETTERS:
+            prediction = char
+            break
+    return prediction, {}
+
+_logits_to_keep_kwargs = None
 
-        messages = [{"role": "user", "content": content}]
+def logits_to_keep_kwargs():
+    """
+    只算最后一个位置的 logits (否则 ~4k token x 15 万词表，显存多占 1-2 GB)
+    新版 transformers 叫 logits_to_keep，旧版叫 num_logits_to_keep，都没有就算全部
+    """
+    global _logits_to_keep_kwargs
+    if _logits_to_keep_kwargs is None:
+        import inspect
+        params = inspect.signature(model.forward).parameters
+        _logits_to_keep_kwargs = {}
+        for name in ("logits_to_keep", "num_logits_to_keep"):
+            if name in params:
+                _logits_to_keep_kwargs = {name: 1}
+                break
+    return _logits_to_keep_kwargs
+
+def score_options(inputs, temperature=1.0):
+    """
+    只做一次前向：取最后一个位置上 A-D 四个 token 的 logits，
+    argmax 作为答案，softmax(logits / T) 作为校准后的概率分布
+    """
+    with torch.no_grad(), span("forward"):
+        last_logits = model(**inputs, **logits_to_keep_kwargs()).logits[0, -1]
+    option_logits = last_logits[get_option_token_ids()].float()
+    probs = torch.softmax(option_logits / temperature, dim=-1)
+
+    best = int(torch.argmax(probs))
+    return OPTION_LETTERS[best], {
+        "option_logits": [round(v, 4) for v in option_logits.tolist()],
+        "probabilities": [round(v, 4) for v in probs.tolist()],
+        "confidence": round(float(probs[best]), 4)
+    }
+
+def predict(messages, decode_mode=DECODE_MODE, temperature=1.0):
+    """
+    用 Qwen-VL 回答一道题，返回 (答案字母, 额外记录的字段)
+    先查响应缓存：命中就直接返回，连模型都不用加载
+    """
+    key = None
+    if USE_RESPONSE_CACHE:
+        cache = get_response_cache()
+        with span("response_cache_lookup"):
+            key = cache.make_key(MODEL_PATH, {
+                "min_pixels": MIN_PIXELS,
+                "max_pixels": MAX_PIXELS,
+                "load_in_4bit": LOAD_IN_4BIT,
+                "max_new_tokens": MAX_NEW_TOKENS,
+                "decode_mode": decode_mode,
+                "temperature": temperature if decode_mode == "logits" else None,
+            }, messages)
+            cached = cache.get(key)
+        if cached is not None:
+            prediction, extra = cached
+            return prediction, {**extra, "cache_hit": True}
+
+    load_model()
 
-        # 4. 推理预处理
+    # 4. 推理预处理
+    with span("processor_call"):
         text = processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
         image_inputs, video_inputs = process_vision_info(messages)
         inputs = processor(
@@ -77,47 +214,163 @@ def run_evaluation():
             return_tensors="pt"
         ).to("cuda")
 
-        # 5. 生成答案
-        with torch.no_grad():
-            generated_ids = model.generate(**inputs, max_new_tokens=10)
-            generated_ids_trimmed = [
-                out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            output_text = processor.batch_decode(
-                generated_ids_trimmed, 
-                skip_special_tokens=True, 
-                clean_up_tokenization_spaces=False
-            )[0].strip()
+    # 5. 生成答案
+    if decode_mode == "logits":
+        prediction, extra = score_options(inputs, temperature)
+    else:
+        prediction, extra = generate_answer(inputs)
+
+    extra["input_tokens"] = int(inputs.input_ids.shape[1])
+    if key is not None:
+        get_response_cache().put(key, prediction, extra)
+    return prediction, {**extra, "cache_hit": False}
+
+def evaluate(questions, prompt_mode=PROMPT_MODE, decode_mode=DECODE_MODE, predict_fn=predict):
+    """
+    逐题推理，返回每道题的结果 (含耗时)
+    predict_fn 可以换成假模型 (见 benchmark_pipeline.py)，签名和 predict 一样
+    """
+    results = []
+    # logits 模式下用 answer_calibration.py 拟合出来的温度 (没有就是 1.0)
+    temperature = load_temperature() if decode_mode == "logits" else 1.0
+
+    for q in questions:
+        start_time = time.perf_counter()
+        load_before = model_load_seconds
+
+        # 3. 构造消息结构
+        messages = build_messages(q, prompt_mode)
+        prediction, extra = predict_fn(messages, decode_mode, temperature)
+
+        # 第一次推理时才加载模型 (缓存全命中就不加载)，加载时间不算进这道题
+        latency = time.perf_counter() - start_time - (model_load_seconds - load_before)
 
         # 6. 验证与记录
-        # 简单清洗输出，只取第一个字母
-        prediction = ""
-        for char in output_text.upper():
-            if char in ['A', 'B', 'C', 'D']:
-                prediction = char
-                break
-                
+        # 缓存命中的题没有真正推理，耗时记为空 (不进直方图、平均耗时和结果库的 latency_s 列)
         is_correct = (prediction == q['correct'])
+        cache_hit = bool(extra.get("cache_hit"))
+        if not cache_hit:
+            observe("question_latency_seconds", latency, prompt_mode=prompt_mode, decode_mode=decode_mode)
+        incr("questions_evaluated", correct=str(is_correct).lower())
         
-        print(f"[{q['question_id']}] 推测: {prediction} | 正确: {q['correct']} | {'✅' if is_correct else '❌'}")
+        print(f"[{q['question_id']}] 推测: {prediction} | 正确: {q['correct']} | {'✅' if is_correct else '❌'} | {'缓存' if cache_hit else f'{latency:.2f}s'}")
         
         results.append({
             "id": q['question_id'],
+            "bp": q['bp'],
             "target_side": q['target_side'],
+            "prompt_mode": prompt_mode,
+            "decode_mode": decode_mode,
             "prediction": prediction,
             "ground_truth": q['correct'],
-            "is_correct": is_correct
+            "is_correct": is_correct,
+            "latency_s": None if cache_hit else round(latency, 4),
+            **extra
         })
 
+    return results
+
+def load_questions():
+    # 读取 JSON 数据库
+    if not os.path.exists(JSON_PATH):
+        print(f"❌ 找不到 JSON 文件: {JSON_PATH}")
+        return None
+        
+    with open(JSON_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data['questions']
+
+def summarize(results):
+    """
+    计算准确率和平均耗时
+    """
+    n = len(results)
+    # 平均耗时只算真正推理过的题 (缓存命中的 latency_s 是 None)
+    timed = [r['latency_s'] for r in results if r['latency_s'] is not None]
+    return {
+        "count": n,
+        "accuracy": sum([1 for r in results if r['is_correct']]) / n if n else 0,
+        "mean_latency_s": sum(timed) / len(timed) if timed else 0,
+        "timed_count": len(timed),
+        "mean_input_tokens": sum(r.get('input_tokens', 0) for r in results) / n if n else 0,
+        "cache_hits": sum([1 for r in results if r.get('cache_hit')]),
+    }
+
+def run_evaluation(prompt_mode=PROMPT_MODE, decode_mode=DECODE_MODE):
+    questions = load_questions()
+    if questions is None:
+        return
+    
+    print(f"开始测试 ({prompt_mode} 模式, {decode_mode} 解码)，总计题目数: {len(questions)}")
+
+    # 为了安全起见，你可以先只测试前 5 道题：questions[:5]
+    results = evaluate(questions, prompt_mode, decode_mode)
+
     # 7. 保存结果并输出准确率
-    with open("inference_results.json", "w", encoding="utf-8") as f:
+    output_file = "inference_results.json"
+    if prompt_mode != "multi":
+        output_file = output_file.replace(".json", f"_{prompt_mode}.json")
+    if decode_mode != "generate":
+        output_file = output_file.replace(".json", f"_{decode_mode}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=4)
+    # 同时追加到按列存储的结果库 (不会被下一次运行覆盖，见 eval_store.py)
+    run_id = append_run(results, model_name(MODEL_PATH), questions_json=JSON_PATH)
         
-    accuracy = sum([1 for r in results if r['is_correct']]) / len(results) if results else 0
+    summary = summarize(results)
     print(f"\n" + "="*30)
-    print(f"测试完成！最终准确率: {accuracy * 100:.2f}%")
-    print(f"详细日志已保存至: inference_results.json")
+    print(f"测试完成！最终准确率: {summary['accuracy'] * 100:.2f}%")
+    print(f"平均每题耗时: {summary['mean_latency_s']:.2f}s (只算实际推理的 {summary['timed_count']} 题)")
+    print(f"响应缓存命中: {summary['cache_hits']}/{summary['count']} (只有输入变了的题才真正推理)")
+    print(f"详细日志已保存至: {output_file}")
+    print(f"结果库 run_id: {run_id}")
     print("="*30)
 
+def compare_prompt_modes(modes=("multi", "composite"), decode_mode=DECODE_MODE):
+    """
+    A/B 对比：同一批题目分别用多图模式和拼图模式跑一遍，对比准确率和耗时
+    """
+    questions = load_questions()
+    if questions is None:
+        return
+
+    report = {}
+    per_question = {}
+    for mode in modes:
+        print(f"\n🔬 A/B 测试：{mode} 模式")
+        results = evaluate(questions, mode, decode_mode)
+        report[mode] = summarize(results)
+        report[mode]["run_id"] = append_run(results, model_name(MODEL_PATH), questions_json=JSON_PATH)
+        for r in results:
+            per_question.setdefault(r['id'], {})[mode] = r['prediction']
+
+    # 两种模式答案不一致的题目，方便之后做误差分析
+    disagreements = [qid for qid, preds in per_question.items() if len(set(preds.values())) > 1]
+    report["disagreement_count"] = len(disagreements)
+    report["disagreements"] = disagreements
+
+    with open("prompt_mode_ab.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"\n" + "="*50)
+    print(f"{'模式':<12}{'准确率':>10}{'平均耗时(s)':>14}{'平均输入token':>16}")
+    for mode in modes:
+        m = report[mode]
+        latency = f"{m['mean_latency_s']:.2f}" if m['timed_count'] else "-"
+        print(f"{mode:<12}{m['accuracy'] * 100:>9.2f}%{latency:>14}{m['mean_input_tokens']:>16.0f}")
+    print(f"答案不一致的题目数: {len(disagreements)}")
+    print(f"响应缓存命中: " + ", ".join(f"{mode} {report[mode]['cache_hits']}/{report[mode]['count']}" for mode in modes))
+    print(f"对比结果已保存至: prompt_mode_ab.json")
+    print("="*50)
+
 if __name__ == "__main__":
-    run_evaluation()
\ No newline at end of file
+    # python test_qwen_vl.py            -> 默认模式
+    # python test_qwen_vl.py composite  -> 拼图模式
+    # python test_qwen_vl.py ab         -> 多图 vs 拼图 A/B 对比
+    # 第二个参数可选解码方式，例如: python test_qwen_vl.py multi logits
+    mode = sys.argv[1] if len(sys.argv) > 1 else PROMPT_MODE
+    decode_mode = sys.argv[2] if len(sys.argv) > 2 else DECODE_MODE
+    if mode == "ab":
+        compare_prompt_modes(decode_mode=decode_mode)
+    else:
+        run_evaluation(mode, decode_mode)
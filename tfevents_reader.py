@@ -0,0 +1,317 @@
+import os
+import sys
+import glob
+import json
+import time
+import struct
+import numpy as np
+
+# ====================================================================
+# --- 配置参数 ---
+# ====================================================================
+LOG_ROOT = "log"
+EVENT_GLOB = "events.out.tfevents.*"
+SUMMARY_FILE = "log_summary.json"
+FOLLOW_INTERVAL = 2.0   # tail-follow 时每隔几秒看一次文件有没有变长
+VERIFY_CRC = False      # 默认不校验 CRC (纯 Python 算 CRC32C 很慢)，怀疑文件损坏时再打开
+
+# 不用装 TensorFlow / TensorBoard，直接按格式解析：
+# TFRecord: uint64 长度 | uint32 长度的 masked CRC | 数据 | uint32 数据的 masked CRC
+# 数据是 protobuf 的 Event：1=wall_time(double) 2=step(int64) 5=summary
+#   Summary: 1=value (repeated)
+#   Value:   1=tag 2=simple_value(float) 8=tensor (TF2 的 scalar 写在这里)
+#   Tensor:  1=dtype 4=tensor_content 5=float_val 6=double_val
+_HEADER = struct.Struct("<QI")
+
+
+# ====================================================================
+# CRC32C (只在 VERIFY_CRC=True 时用)
+# ====================================================================
+def _make_crc_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def masked_crc32c(data):
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = _CRC_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    crc ^= 0xFFFFFFFF
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+# ====================================================================
+# 最小的 protobuf 解码
+# ====================================================================
+def _varint(buf, pos):
+    result, shift = 0, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """
+    逐个产出 (字段号, wire type, 值)；长度分隔的字段值是 memoryview，不拷贝
+    """
+    pos, end = 0, len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(buf, pos)
+        elif wire == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire == 2:
+            length, pos = _varint(buf, pos)
+            value, pos = buf[pos:pos + length], pos + length
+        elif wire == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"不支持的 wire type: {wire}")
+        yield field, wire, value
+
+
+def _tensor_scalar(buf):
+    dtype, values = 1, []
+    for field, wire, value in _fields(buf):
+        if field == 1:
+            dtype = value
+        elif field == 4:  # tensor_content: 原始小端字节
+            fmt = {1: "<f", 2: "<d", 3: "<i", 9: "<q"}.get(dtype)
+            if fmt and len(value) >= struct.calcsize(fmt):
+                values.append(struct.unpack_from(fmt, value)[0])
+        elif field == 5:
+            values.append(struct.unpack("<f", value)[0] if wire == 5 else struct.unpack_from("<f", value)[0])
+        elif field == 6:
+            values.append(struct.unpack("<d", value)[0] if wire == 1 else struct.unpack_from("<d", value)[0])
+    return values[0] if values else None
+
+
+def parse_event(data):
+    """
+    Event 的字节 -> (wall_time, step, [(tag, value), ...])，只保留标量
+    """
+    wall_time, step, scalars = 0.0, 0, []
+    for field, wire, value in _fields(memoryview(data)):
+        if field == 1:
+            wall_time = struct.unpack("<d", value)[0]
+        elif field == 2:
+            step = value
+        elif field == 5:
+            for f, _, v in _fields(value):
+                if f != 1:
+                    continue
+                tag, scalar = None, None
+                for vf, vw, vv in _fields(v):
+                    if vf == 1:
+                        tag = bytes(vv).decode("utf-8", "replace")
+                    elif vf == 2:
+                        scalar = struct.unpack("<f", vv)[0]
+                    elif vf == 8 and scalar is None:
+                        scalar = _tensor_scalar(vv)
+                if tag is not None and scalar is not None:
+                    scalars.append((tag, scalar))
+    return wall_time, step, scalars
+
+
+# ====================================================================
+# 流式读取 + tail-follow
+# ====================================================================
+class EventFileReader:
+    """
+    记住已经读到的位置，每次 read_new() 只解析新追加的完整记录
+    训练还在写的时候，最后一条可能只写了一半，留到下次再读
+    """
+
+    def __init__(self, path, verify_crc=VERIFY_CRC):
+        self.path = path
+        self.verify_crc = verify_crc
+        self.offset = 0
+        self.corrupt_records = 0
+
+    def read_new(self):
+        events = []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        pos = 0
+        while pos + _HEADER.size <= len(data):
+            length, len_crc = _HEADER.unpack_from(data, pos)
+            end = pos + _HEADER.size + length + 4
+            if end > len(data):
+                break
+            record = data[pos + _HEADER.size:end - 4]
+            if self.verify_crc:
+                data_crc = struct.unpack_from("<I", data, end - 4)[0]
+                if masked_crc32c(data[pos:pos + 8]) != len_crc or masked_crc32c(record) != data_crc:
+                    self.corrupt_records += 1
+                    pos = end
+                    continue
+            events.append(parse_event(record))
+            pos = end
+        self.offset += pos
+        return events
+
+
+class ScalarStore:
+    """
+    按 (run, tag) 存成列：step / wall_time / value 三个数组
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def add(self, run, events):
+        for wall_time, step, scalars in events:
+            for tag, value in scalars:
+                col = self.columns.setdefault((run, tag), ([], [], []))
+                col[0].append(step)
+                col[1].append(wall_time)
+                col[2].append(value)
+
+    def arrays(self, run, tag):
+        steps, times, values = self.columns[(run, tag)]
+        return np.array(steps, dtype=np.int64), np.array(times), np.array(values, dtype=np.float64)
+
+    def runs(self):
+        return sorted({run for run, _ in self.columns})
+
+    def tags(self, run):
+        return sorted(tag for r, tag in self.columns if r == run)
+
+
+def find_event_files(log_root=LOG_ROOT):
+    """
+    log/<时间戳>/<network_train|finetuning>/events.out.tfevents.* -> run 名字是 "<时间戳>/<子目录>"
+    """
+    files = {}
+    for path in sorted(glob.glob(os.path.join(log_root, "**", EVENT_GLOB), recursive=True)):
+        run = os.path.relpath(os.path.dirname(path), log_root).replace(os.sep, "/")
+        files[path] = run
+    return files
+
+
+def load_runs(log_root=LOG_ROOT, verify_crc=VERIFY_CRC):
+    store = ScalarStore()
+    readers = {}
+    for path, run in find_event_files(log_root).items():
+        readers[path] = EventFileReader(path, verify_crc)
+        store.add(run, readers[path].read_new())
+    return store, readers
+
+
+# ====================================================================
+# 汇总
+# ====================================================================
+def _finite_stats(values):
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return {"last": None, "min": None, "mean_last10": None}
+    return {
+        "last": float(finite[-1]),
+        "min": float(finite.min()),
+        "mean_last10": float(finite[-10:].mean()),
+    }
+
+
+def summarize_runs(store):
+    """
+    每个 run 每个 tag：点数、step 范围、最后值 / 最小值 / 最后 10 个点的均值、非有限值 (NaN/inf) 个数
+    每个 run 额外算一个 sec_per_step (用点最多的那个 tag 的 wall_time 差 / step 差，取中位数)
+    曲线本身按列存 (steps / values)，方便在脚本或 CI 里直接比较
+    """
+    summary = {}
+    for run in store.runs():
+        tags, curves, best_tag = {}, {}, None
+        for tag in store.tags(run):
+            steps, times, values = store.arrays(run, tag)
+            tags[tag] = {
+                "points": int(len(steps)),
+                "first_step": int(steps[0]),
+                "last_step": int(steps[-1]),
+                "non_finite": int((~np.isfinite(values)).sum()),
+                **_finite_stats(values),
+            }
+            curves[tag] = {"steps": steps.tolist(), "values": [v if np.isfinite(v) else None for v in values.tolist()]}
+            if best_tag is None or len(steps) > tags[best_tag]["points"]:
+                best_tag = tag
+
+        sec_per_step = None
+        if best_tag is not None:
+            steps, times, _ = store.arrays(run, best_tag)
+            dstep = np.diff(steps)
+            ok = dstep > 0
+            if ok.any():
+                sec_per_step = float(np.median(np.diff(times)[ok] / dstep[ok]))
+        summary[run] = {"sec_per_step": sec_per_step, "tags": tags, "curves": curves}
+    return summary
+
+
+def print_summary(summary):
+    print("\n" + "=" * 40)
+    print("📈 训练日志汇总")
+    print("-" * 40)
+    for run, info in summary.items():
+        sps = f"{info['sec_per_step']:.3f}s/step" if info["sec_per_step"] is not None else "-"
+        print(f"📂 {run}  ({sps})")
+        for tag, t in info["tags"].items():
+            last = f"{t['last']:.5g}" if t["last"] is not None else "n/a"
+            best = f"{t['min']:.5g}" if t["min"] is not None else "n/a"
+            warn = f"  ⚠️ {t['non_finite']} 个 NaN/inf" if t["non_finite"] else ""
+            print(f"   {tag:<24} {t['points']:>5} 点  step {t['first_step']}-{t['last_step']}  最后 {last}  最小 {best}{warn}")
+    print("=" * 40 + "\n")
+
+
+def follow(log_root=LOG_ROOT, interval=FOLLOW_INTERVAL, verify_crc=VERIFY_CRC):
+    """
+    tail-follow：只读新追加的记录，打印新出现的标量；新建的事件文件也会被接上
+    """
+    store, readers = load_runs(log_root, verify_crc)
+    print(f"👀 正在跟踪 {len(readers)} 个事件文件 (Ctrl+C 退出)...")
+    try:
+        while True:
+            time.sleep(interval)
+            for path, run in find_event_files(log_root).items():
+                reader = readers.setdefault(path, EventFileReader(path, verify_crc))
+                for wall_time, step, scalars in reader.read_new():
+                    store.add(run, [(wall_time, step, scalars)])
+                    for tag, value in scalars:
+                        print(f"{run}  step {step:>6}  {tag} = {value:.5g}")
+    except KeyboardInterrupt:
+        pass
+    return store
+
+
+if __name__ == "__main__":
+    # python tfevents_reader.py [log目录]          -> 汇总所有 run，写 log_summary.json
+    # python tfevents_reader.py follow [log目录]   -> 持续跟踪正在训练的 run
+    # 加 --verify-crc 校验每条记录的 CRC
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    verify = "--verify-crc" in sys.argv
+    if args and args[0] == "follow":
+        follow(args[1] if len(args) > 1 else LOG_ROOT, verify_crc=verify)
+    else:
+        start = time.perf_counter()
+        store, readers = load_runs(args[0] if args else LOG_ROOT, verify)
+        summary = summarize_runs(store)
+        elapsed = time.perf_counter() - start
+        with open(SUMMARY_FILE, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        print_summary(summary)
+        corrupt = sum(r.corrupt_records for r in readers.values())
+        if verify:
+            print(f"🔒 CRC 校验失败的记录: {corrupt}")
+        print(f"⏱️ 解析 {len(readers)} 个文件用时 {elapsed * 1000:.1f}ms，结果已保存至: {SUMMARY_FILE}")